@@ -21,6 +21,7 @@ from jsanctions.models import (
     Citizenship,
     Address,
     SanctionsListFile,
+    is_name_search_supported,
 )
 
 
@@ -364,6 +365,19 @@ class CitizenshipCountryFilter(admin.SimpleListFilter):
         return queryset
 
 
+class ActiveListFilter(admin.SimpleListFilter):
+    title = _("active list")
+    parameter_name = "active"
+
+    def lookups(self, request, model_admin):
+        return [("1", _("yes"))]
+
+    def queryset(self, request, queryset):
+        if self.value() == "1":
+            queryset = queryset.active()
+        return queryset
+
+
 class SanctionEntityAdmin(SanctionsListAdminBase):
     search_fields = (
         "namealias__whole_name__icontains",
@@ -396,6 +410,7 @@ class SanctionEntityAdmin(SanctionsListAdminBase):
         "subject_type",
     )
     list_filter = (
+        ActiveListFilter,
         "subject_type",
         DecadeBornListFilter,
         AddressCountryFilter,
@@ -416,7 +431,7 @@ class SanctionEntityAdmin(SanctionsListAdminBase):
 
     def data_fmt(self, obj) -> str:
         try:
-            return mark_safe("<pre>" + json.dumps(obj.data, indent=4, sort_keys=True) + "</pre>")
+            return mark_safe("<pre>" + json.dumps(obj.get_data(), indent=4, sort_keys=True) + "</pre>")
         except Exception:
             return mark_safe("<pre>" + traceback.format_exc() + "</pre>")
 
@@ -444,6 +459,12 @@ class SanctionEntityAdmin(SanctionsListAdminBase):
             qs = qs.filter(source_id=source_id)
         return qs
 
+    def get_search_results(self, request, queryset, search_term):
+        qs, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term and is_name_search_supported():
+            qs |= queryset.filter(id__in=SanctionEntity.objects.search_name(search_term).values("id"))
+        return qs, may_have_duplicates
+
     def get_urls(self):
         info = self.model._meta.app_label, self.model._meta.model_name  # type: ignore  # noqa
         return [
@@ -0,0 +1,283 @@
+import io
+import json
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Type, Sequence, Optional, Any, Tuple, Iterable
+from django.core.exceptions import ValidationError
+from django.db import connections, models, transaction
+from jsanctions.data_storage import get_data_storage, compress_data, write_data_archive, DATA_STORAGE_DB, DATA_STORAGE_COMPRESSED, DATA_STORAGE_ARCHIVE
+from jsanctions.models import SanctionListObject, SanctionEntity, SanctionEntityData
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMPORT_BATCH_SIZE = 500
+
+BULK_LOADER = "bulk"
+COPY_LOADER = "copy"
+LOADERS = [BULK_LOADER, COPY_LOADER]
+
+
+def sync_foreign_key_ids(obj: models.Model):
+    """Copies primary keys of related objects which were saved after assignment to foreign key id fields."""
+    for field in obj._meta.concrete_fields:  # type: ignore
+        if field.is_relation and field.is_cached(obj):
+            rel = field.get_cached_value(obj)
+            if rel is not None and getattr(obj, field.attname) is None:
+                setattr(obj, field.attname, rel.pk)
+
+
+def clean_objects(model: Type[models.Model], objs: Sequence[models.Model]):
+    """Validates objects of the same model in a single pass. Equivalent to calling full_clean() for each object
+    except that the validated field list is resolved once per model and foreign key existence checks
+    (one SELECT per row) are skipped since related objects are written in the same batch.
+    """
+    fields = [f for f in model._meta.concrete_fields if not f.is_relation and not f.primary_key]  # type: ignore
+    for obj in objs:
+        errors: Dict[str, List[ValidationError]] = {}
+        for f in fields:
+            raw_value = getattr(obj, f.attname)
+            if f.blank and raw_value in f.empty_values:
+                continue
+            try:
+                setattr(obj, f.attname, f.clean(raw_value, obj))
+            except ValidationError as e:
+                errors[f.name] = e.error_list
+        if errors:
+            raise ValidationError(errors)
+        obj.clean()
+
+
+class BulkWriter:
+    """Collects unsaved sanction list objects and writes them with a few bulk inserts per model.
+    SanctionListObject subclasses use multi-table inheritance, so parent rows are created first
+    with a single bulk insert and child table rows are then inserted with the allocated ids.
+    Objects are grouped per sanction entity: a new group starts whenever SanctionEntity is added.
+    If validate is True objects are validated with clean_objects() before writing.
+    """
+
+    def __init__(self, using: str = "default", validate: bool = False):
+        self.using = using
+        self.validate = validate
+        self.groups: List[List[models.Model]] = []
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def add(self, obj: models.Model) -> models.Model:
+        if isinstance(obj, SanctionEntity) or not self.groups:
+            self.groups.append([])
+        self.groups[-1].append(obj)
+        return obj
+
+    def flush(self):
+        if not self.groups:
+            return
+        objs = [obj for group in self.groups for obj in group]
+        with transaction.atomic(using=self.using):
+            self.write(objs)
+        self.groups = []
+
+    def write(self, objs: List[models.Model]):
+        # multi-table inherited models first so that plain models (Remark) can refer to them
+        by_model: Dict[Type[models.Model], List[models.Model]] = {}
+        for obj in sorted(objs, key=lambda e: not isinstance(e, SanctionListObject)):
+            by_model.setdefault(type(obj), []).append(obj)
+        if self.validate:
+            for model, model_objs in by_model.items():
+                clean_objects(model, model_objs)
+
+        self.allocate_ids([obj for obj in objs if isinstance(obj, SanctionListObject)])
+        for model, model_objs in by_model.items():
+            for obj in model_objs:
+                sync_foreign_key_ids(obj)
+            self.insert(model, model_objs)
+            for obj in model_objs:
+                obj._state.adding = False
+                obj._state.db = self.using
+            logger.debug("%s %s rows inserted", len(model_objs), model.__name__)
+
+    def allocate_ids(self, objs: List[models.Model]):
+        """Creates SanctionListObject parent rows for multi-table inherited objects and assigns the ids."""
+        if not objs:
+            return
+        parents = [SanctionListObject() for _ in objs]
+        if connections[self.using].features.can_return_rows_from_bulk_insert:
+            SanctionListObject.objects.using(self.using).bulk_create(parents)
+        else:
+            for parent in parents:
+                parent.save(using=self.using)
+        for obj, parent in zip(objs, parents):
+            obj.pk = obj.id = parent.id  # type: ignore
+
+    def insert(self, model: Type[models.Model], objs: List[models.Model]):
+        if issubclass(model, SanctionListObject):
+            fields = model._meta.local_concrete_fields  # type: ignore
+            batch_size = max(connections[self.using].ops.bulk_batch_size(fields, objs), 1)
+            for i in range(0, len(objs), batch_size):
+                model._base_manager._insert(objs[i : i + batch_size], fields=fields, using=self.using)  # type: ignore
+        else:
+            model._base_manager.using(self.using).bulk_create(objs)  # type: ignore
+
+
+def format_copy_value(field: models.Field, obj: models.Model, connection) -> str:
+    """Formats model field value for PostgreSQL COPY text format."""
+    value = field.pre_save(obj, add=True)
+    if value is not None:
+        if isinstance(field, models.JSONField):
+            value = json.dumps(value, cls=field.encoder)
+        elif isinstance(field, models.BinaryField):
+            value = "\\x" + bytes(value).hex()
+        else:
+            value = field.get_db_prep_save(value, connection)
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class PostgresCopyWriter(BulkWriter):
+    """Bulk writer which streams rows to PostgreSQL with COPY FROM STDIN.
+    Primary keys are pre-allocated from the table sequences so no rows need to be read back.
+    """
+
+    def __init__(self, using: str = "default", validate: bool = False):
+        if connections[using].vendor != "postgresql":
+            raise Exception("{} loader requires PostgreSQL database".format(COPY_LOADER))
+        super().__init__(using=using, validate=validate)
+
+    def next_ids(self, model: Type[models.Model], count: int) -> List[int]:
+        pk = model._meta.pk  # type: ignore
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                [model._meta.db_table, pk.column, count],  # type: ignore
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def copy(self, model: Type[models.Model], objs: List[models.Model], fields: Sequence[models.Field]):
+        connection = connections[self.using]
+        qn = connection.ops.quote_name
+        sql = "COPY {} ({}) FROM STDIN".format(qn(model._meta.db_table), ", ".join(qn(f.column) for f in fields))  # type: ignore
+        buf = io.StringIO()
+        for obj in objs:
+            buf.write("\t".join(format_copy_value(f, obj, connection) for f in fields))
+            buf.write("\n")
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            if hasattr(cursor, "copy_expert"):  # psycopg2
+                cursor.copy_expert(sql, buf)
+            else:  # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buf.getvalue())
+
+    def allocate_ids(self, objs: List[models.Model]):
+        if not objs:
+            return
+        parents = [SanctionListObject(id=pk) for pk in self.next_ids(SanctionListObject, len(objs))]
+        self.copy(SanctionListObject, parents, [SanctionListObject._meta.pk])  # type: ignore
+        for obj, parent in zip(objs, parents):
+            obj.pk = obj.id = parent.id  # type: ignore
+
+    def insert(self, model: Type[models.Model], objs: List[models.Model]):
+        if issubclass(model, SanctionListObject):
+            self.copy(model, objs, model._meta.local_concrete_fields)  # type: ignore
+        else:
+            new_objs = [obj for obj in objs if obj.pk is None]
+            for obj, pk in zip(new_objs, self.next_ids(model, len(new_objs))):
+                obj.pk = pk
+            self.copy(model, objs, model._meta.concrete_fields)  # type: ignore
+
+
+def create_bulk_writer(loader: str = BULK_LOADER, using: str = "default", validate: bool = False) -> BulkWriter:
+    """Returns bulk writer for the loader backend, either BULK_LOADER (bulk INSERTs) or COPY_LOADER (PostgreSQL COPY)."""
+    if loader == BULK_LOADER:
+        return BulkWriter(using=using, validate=validate)
+    if loader == COPY_LOADER:
+        return PostgresCopyWriter(using=using, validate=validate)
+    raise Exception("Unknown loader: {}".format(loader))
+
+
+def save_object(obj: models.Model, writer: Optional[BulkWriter] = None):
+    """Adds object to bulk writer if specified, otherwise validates and saves the object immediately."""
+    if writer is not None:
+        writer.add(obj)
+    else:
+        sync_foreign_key_ids(obj)
+        obj.full_clean()
+        obj.save()
+
+
+def persist_objects(objs: Sequence[models.Model], writer: Optional[BulkWriter] = None):
+    """Persists an object graph assembled in memory. Objects must be in save order, i.e. related objects
+    before the objects referring to them. See save_object()."""
+    for obj in objs:
+        save_object(obj, writer)
+
+
+def save_sanction_entity_data(se: SanctionEntity, data: Dict[str, Any], writer: Optional[BulkWriter] = None):
+    """Stores raw source data of the entity according to JSANCTIONS_DATA_STORAGE, see data_storage.py.
+    Call after the entity fields (logical_id, data_hash) have been set."""
+    storage = get_data_storage()
+    if storage == DATA_STORAGE_DB:
+        se.data = data
+        if writer is None and se.pk is not None:
+            se.save(update_fields=["data"])
+    elif storage == DATA_STORAGE_COMPRESSED:
+        save_object(SanctionEntityData(entity=se, blob=compress_data(data)), writer)
+    elif storage == DATA_STORAGE_ARCHIVE:
+        write_data_archive(se.source.list_type, se.logical_id, se.data_hash, data)
+
+
+class LookupCache:
+    """Import-scoped cache of lookup table rows (SubjectType, RegulationSummary) indexed by lookup field values.
+    Rows of a model are loaded with a single query on first use. Missing rows are created only once,
+    either one by one with get_or_create() or in bulk with create_missing().
+    Cache can be passed to worker processes as long as all rows the workers need have been created beforehand.
+    """
+
+    def __init__(self, using: str = "default"):
+        self.using = using
+        self.indexes: Dict[Tuple[Type[models.Model], Tuple[str, ...]], Dict[Tuple[Any, ...], models.Model]] = {}
+
+    def get_index(self, model: Type[models.Model], fields: Tuple[str, ...]) -> Dict[Tuple[Any, ...], models.Model]:
+        index = self.indexes.get((model, fields))
+        if index is None:
+            index = {}
+            for obj in model.objects.using(self.using).order_by("-id"):  # type: ignore
+                index[tuple(getattr(obj, f) for f in fields)] = obj  # the oldest row wins on duplicates
+            self.indexes[(model, fields)] = index
+            logger.debug("%s %s rows preloaded", len(index), model.__name__)
+        return index
+
+    def add(self, obj: models.Model):
+        for (model, fields), index in self.indexes.items():
+            if model is type(obj):
+                index.setdefault(tuple(getattr(obj, f) for f in fields), obj)
+
+    def get_or_create(self, model: Type[models.Model], **kwargs) -> Tuple[Any, bool]:
+        fields = tuple(sorted(kwargs))
+        obj = self.get_index(model, fields).get(tuple(kwargs[f] for f in fields))
+        if obj is not None:
+            return obj, False
+        obj = model(**kwargs)
+        obj.save(using=self.using)
+        self.add(obj)
+        return obj, True
+
+    def create_missing(self, lookups: Iterable[Tuple[Type[models.Model], Dict[str, Any]]]) -> int:
+        """Creates missing rows for (model, lookup kwargs) pairs with bulk inserts. Returns number of created rows."""
+        new_objs: Dict[Tuple[Any, ...], models.Model] = {}
+        for model, kwargs in lookups:
+            fields = tuple(sorted(kwargs))
+            k = tuple(kwargs[f] for f in fields)
+            if k not in self.get_index(model, fields) and (model, fields, k) not in new_objs:
+                new_objs[(model, fields, k)] = model(**kwargs)
+        if new_objs:
+            with transaction.atomic(using=self.using):
+                BulkWriter(using=self.using).write(list(new_objs.values()))
+            for obj in new_objs.values():
+                self.add(obj)
+        return len(new_objs)
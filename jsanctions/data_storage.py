@@ -0,0 +1,71 @@
+import gzip
+import json
+import logging
+import os
+import zlib
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from jutil.format import get_media_full_path
+
+logger = logging.getLogger(__name__)
+
+DATA_STORAGE_DB = "db"  # SanctionEntity.data JSON column
+DATA_STORAGE_OFF = "off"  # raw data not stored
+DATA_STORAGE_COMPRESSED = "compressed"  # zlib compressed JSON in SanctionEntityData table
+DATA_STORAGE_ARCHIVE = "archive"  # gzip compressed JSON files in JSANCTIONS_DATA_ARCHIVE_DIR
+DATA_STORAGES = [DATA_STORAGE_DB, DATA_STORAGE_OFF, DATA_STORAGE_COMPRESSED, DATA_STORAGE_ARCHIVE]
+
+
+def get_data_storage() -> str:
+    """Returns storage policy of raw sanction entity source data, settings.JSANCTIONS_DATA_STORAGE (default "db")."""
+    storage = getattr(settings, "JSANCTIONS_DATA_STORAGE", DATA_STORAGE_DB)
+    if storage not in DATA_STORAGES:
+        raise Exception("Invalid JSANCTIONS_DATA_STORAGE: {}".format(storage))
+    return storage
+
+
+def get_data_archive_dir() -> str:
+    """Returns raw data archive root directory, settings.JSANCTIONS_DATA_ARCHIVE_DIR (default MEDIA_ROOT/jsanctions/data)."""
+    return getattr(settings, "JSANCTIONS_DATA_ARCHIVE_DIR", "") or get_media_full_path("jsanctions/data")
+
+
+def compress_data(data: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(data, cls=DjangoJSONEncoder).encode())
+
+
+def decompress_data(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob).decode())
+
+
+def get_data_archive_path(list_type: str, logical_id: Optional[int], data_hash: str) -> str:
+    """Returns archive file path of entity raw data. Files are keyed by list type, logical id and data hash
+    so that versions of an unchanged entity share the same file."""
+    return os.path.join(get_data_archive_dir(), list_type, str(logical_id) if logical_id is not None else "none", data_hash + ".json.gz")
+
+
+def write_data_archive(list_type: str, logical_id: Optional[int], data_hash: str, data: Dict[str, Any]):
+    path = get_data_archive_path(list_type, logical_id, data_hash)
+    if os.path.isfile(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as fp:
+        json.dump(data, fp, cls=DjangoJSONEncoder)
+    os.replace(tmp_path, path)
+
+
+def read_data_archive(list_type: str, logical_id: Optional[int], data_hash: str) -> Optional[Dict[str, Any]]:
+    """Returns archived raw data or None if not archived."""
+    path = get_data_archive_path(list_type, logical_id, data_hash)
+    if not os.path.isfile(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def delete_data_archive(list_type: str, logical_id: Optional[int], data_hash: str):
+    path = get_data_archive_path(list_type, logical_id, data_hash)
+    if os.path.isfile(path):
+        os.unlink(path)
+        logger.debug("%s deleted", path)
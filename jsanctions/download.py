@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, BinaryIO
+from urllib.parse import urlsplit
+import requests
+from urllib3.util.retry import Retry
+from jsanctions.helpers import open_compressed_writer
+from jsanctions.legacy_ssl import get_legacy_session
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST = 2
+DEFAULT_DOWNLOAD_RETRIES = 3
+DEFAULT_DOWNLOAD_BACKOFF_FACTOR = 1.0
+DEFAULT_DOWNLOAD_TIMEOUT = (15.0, 300.0)  # connect, read
+
+
+class DownloadRequest:
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, legacy_ssl: bool = False, compression: str = ""):
+        self.url = url
+        self.headers = headers or {}
+        self.legacy_ssl = legacy_ssl
+        self.compression = compression
+
+
+class DownloadedFile:
+    """Downloaded response body in a temporary file, optionally compressed.
+    content_hash is SHA-256 hex digest of uncompressed content.
+    file is None if the server responded 304 Not Modified.
+    """
+
+    def __init__(self, url: str, file: Optional[BinaryIO] = None, content_hash: str = "", etag: str = "", last_modified: str = ""):
+        self.url = url
+        self.file = file
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def not_modified(self) -> bool:
+        return self.file is None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class DownloadManager:
+    """Downloads files over pooled keep-alive sessions, concurrently with per-host concurrency limits.
+    Connection errors and 429/5xx responses are retried with exponential backoff.
+    Sessions are shared between all downloads of the manager, the legacy SSL session (see legacy_ssl.py) separately.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+        max_per_host: int = DEFAULT_DOWNLOAD_CONNECTIONS_PER_HOST,
+        retries: int = DEFAULT_DOWNLOAD_RETRIES,
+        backoff_factor: float = DEFAULT_DOWNLOAD_BACKOFF_FACTOR,
+        timeout=DEFAULT_DOWNLOAD_TIMEOUT,
+    ):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self._sessions: Dict[bool, requests.Session] = {}
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+    def get_retry(self) -> Retry:
+        return Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+
+    def get_session(self, legacy_ssl: bool = False) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(legacy_ssl)
+            if session is None:
+                adapter_kwargs = {"max_retries": self.get_retry(), "pool_maxsize": self.max_per_host}
+                if legacy_ssl:
+                    session = get_legacy_session(**adapter_kwargs)
+                else:
+                    session = requests.Session()
+                    session.mount("https://", requests.adapters.HTTPAdapter(**adapter_kwargs))
+                session.mount("http://", requests.adapters.HTTPAdapter(**adapter_kwargs))
+                self._sessions[legacy_ssl] = session
+            return session
+
+    def get_host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_semaphores[host]
+
+    def fetch(self, req: DownloadRequest) -> DownloadedFile:
+        """Downloads single URL to a temporary file. Response is requested gzip-encoded and streamed in chunks."""
+        headers = dict(req.headers)
+        headers["Accept-Encoding"] = "gzip"
+        with self.get_host_semaphore(req.url):
+            session = self.get_session(req.legacy_ssl)
+            with session.get(req.url, headers=headers, stream=True, timeout=self.timeout) as res:
+                if res.status_code == 304:
+                    logger.info("%s not modified", req.url)
+                    return DownloadedFile(req.url)
+                res.raise_for_status()
+                h = hashlib.sha256()
+                tmp = tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+                try:
+                    with open_compressed_writer(tmp, req.compression) as out:  # type: ignore
+                        for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            h.update(chunk)
+                            out.write(chunk)
+                    tmp.seek(0)
+                except Exception:
+                    tmp.close()
+                    raise
+                logger.info("%s downloaded", req.url)
+                return DownloadedFile(req.url, tmp, h.hexdigest(), res.headers.get("ETag", ""), res.headers.get("Last-Modified", ""))  # type: ignore
+
+    def fetch_all(self, reqs: Sequence[DownloadRequest]) -> List[DownloadedFile]:
+        """Downloads URLs concurrently. Results are returned in request order.
+        If any download fails, the other downloaded files are closed and the first error re-raised.
+        """
+        if len(reqs) <= 1:
+            return [self.fetch(req) for req in reqs]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(reqs))) as executor:
+            futures = [executor.submit(self.fetch, req) for req in reqs]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            for f in futures:
+                if f.exception() is None:
+                    f.result().close()
+            raise errors[0]  # type: ignore
+        return [f.result() for f in futures]
+
+
+_default_download_manager: Optional[DownloadManager] = None
+
+
+def get_download_manager() -> DownloadManager:
+    """Returns process-wide shared download manager."""
+    global _default_download_manager  # pylint: disable=global-statement
+    if _default_download_manager is None:
+        _default_download_manager = DownloadManager()
+    return _default_download_manager
@@ -1,11 +1,15 @@
-from typing import List, Dict
-from jsanctions.helpers import dict_filter_attributes
+from typing import List, Dict, Iterator, Tuple, Optional, Type
+from jsanctions.bulk import BulkWriter, LookupCache, DEFAULT_IMPORT_BATCH_SIZE, BULK_LOADER, create_bulk_writer, save_sanction_entity_data
+from jsanctions.helpers import get_data_hash, iterparse_xml_elements, load_xml_as_dict
+from jsanctions.services import SanctionListImport, import_sanction_list_file
 from jutil.parse import parse_datetime
-from jutil.xml import xml_to_dict
 import logging
 import os
+from datetime import date
+from functools import lru_cache
 from typing import Any
-from django.db import transaction
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model
 from django.utils.timezone import now
 from jutil.admin import admin_log
 from jsanctions.models import (
@@ -45,9 +49,15 @@ EU_XML_DATE_ATTRIBUTES = [
 ]
 
 
+@lru_cache(maxsize=8192)
+def parse_eu_date(v: str) -> date:
+    """Parses EU list date attribute. Memoized since the same dates repeat heavily in the list."""
+    return parse_datetime(v).date()
+
+
 def eu_sanction_list_xml_attr_filter(k: str, v: Any) -> Any:
     if k.endswith("Date") or k in EU_XML_DATE_ATTRIBUTES:
-        return parse_datetime(v).date()
+        return parse_eu_date(v)
     if k == "@logicalId":
         return int(v)
     if v == "false":
@@ -58,71 +68,149 @@ def eu_sanction_list_xml_attr_filter(k: str, v: Any) -> Any:
 
 
 def load_eu_sanction_list_as_dict(filename: str) -> Dict[str, Any]:
-    with open(filename, "rb") as fp:
-        data: Dict[str, Any] = xml_to_dict(fp.read(), array_tags=EU_XML_ARRAY_TAGS, int_tags=EU_XML_INT_TAGS)
-        data = dict_filter_attributes(data, eu_sanction_list_xml_attr_filter)
-    return data
+    return load_xml_as_dict(filename, array_tags=EU_XML_ARRAY_TAGS, int_tags=EU_XML_INT_TAGS, attr_filter=eu_sanction_list_xml_attr_filter)
+
+
+def iter_eu_sanction_list(filename: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Parses EU sanction list incrementally. Yields root element attributes first
+    and then each sanctionEntity one by one as ("sanctionEntity", data) pairs.
+    Attribute values are converted with eu_sanction_list_xml_attr_filter() during parsing.
+    """
+    yield from iterparse_xml_elements(
+        filename, ["sanctionEntity"], array_tags=EU_XML_ARRAY_TAGS, int_tags=EU_XML_INT_TAGS, attr_filter=eu_sanction_list_xml_attr_filter
+    )
+
+
+def read_eu_generation_date(filename: str) -> Optional[date]:
+    """Returns EU sanction list generation date by parsing only the beginning of the file."""
+    for tag, data in iter_eu_sanction_list(filename):
+        if tag != "sanctionEntity":
+            return data.get("@generationDate")
+    return None
+
 
+EU_CLASS_MAP = {
+    "regulationSummary": RegulationSummary,
+    "subjectType": SubjectType,
+}
 
-def set_eu_object_attr(obj, k: str, v, max_length: int = 512):
-    if v and isinstance(v, str) and len(v) > max_length:
+EU_ARRAY_CLASS_MAP = {
+    "birthdate": BirthDate,
+    "identification": Identification,
+    "address": Address,
+    "citizenship": Citizenship,
+    "nameAlias": NameAlias,
+    "regulation": Regulation,
+}
+
+EU_ARRAY_ATTRIBUTE_NAMES = {k: camel_case_to_underscore(k) for k in EU_ARRAY_CLASS_MAP}
+
+
+@lru_cache(maxsize=None)
+def get_eu_attribute_mapping(model: Type[Model], key: str) -> Optional[Tuple[str, Optional[int]]]:
+    """Returns (attribute name, max length) of the model for EU list XML key (e.g. '@logicalId' or 'nameAlias')
+    or None if the model has no such attribute. Max length is taken from the model field, None if not limited.
+    Mapping is computed once per model and key.
+    """
+    k = camel_case_to_underscore(key[1:] if key.startswith("@") else key)
+    if k == "birthdate" and key.startswith("@"):
+        k = "birth_date"  # special case because class name same as attribute
+    if not hasattr(model, k):
+        return None
+    try:
+        max_length = model._meta.get_field(k).max_length  # type: ignore
+    except FieldDoesNotExist:
+        max_length = None
+    return k, max_length
+
+
+def set_eu_object_attr(obj, k: str, v, max_length: Optional[int] = None):
+    if max_length and v and isinstance(v, str) and len(v) > max_length:
         logger.warning("'%s' truncated to [%s]: '%s...'", k, max_length, v[:64])
         v = v[: max_length - 3] + "..."
     setattr(obj, k, v)
 
 
-def set_eu_members(obj: Any, data: Dict[str, Any], verbose: bool = False, padding: int = 0, **kwargs):  # noqa
-    class_map = {
-        "regulationSummary": RegulationSummary,
-        "subjectType": SubjectType,
-    }
-    array_class_map = {
-        "birthdate": BirthDate,
-        "identification": Identification,
-        "address": Address,
-        "citizenship": Citizenship,
-        "nameAlias": NameAlias,
-        "regulation": Regulation,
+def get_eu_subject_type_lookup(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"code": data.get("@code", ""), "classification_code": data.get("@classificationCode", "")}
+
+
+def get_eu_regulation_summary_lookup(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "regulation_type": data.get("@regulationType", ""),
+        "publication_date": data.get("@publicationDate", None),
+        "publication_url": data.get("@publicationUrl", ""),
+        "number_title": data.get("@numberTitle", ""),
     }
 
+
+def iter_eu_lookups(data: Any) -> Iterator[Tuple[Type[Model], Dict[str, Any]]]:
+    """Yields (model, lookup kwargs) pairs of SubjectType and RegulationSummary rows referred by parsed EU list data."""
+    if isinstance(data, dict):
+        for k, v in data.items():
+            if k == "subjectType":
+                yield SubjectType, get_eu_subject_type_lookup(v)
+            elif k == "regulationSummary":
+                yield RegulationSummary, get_eu_regulation_summary_lookup(v)
+            else:
+                yield from iter_eu_lookups(v)
+    elif isinstance(data, (list, tuple)):
+        for v in data:
+            yield from iter_eu_lookups(v)
+
+
+def set_eu_members(  # noqa
+    obj: Any,
+    data: Dict[str, Any],
+    verbose: bool = False,
+    padding: int = 0,
+    writer: Optional[BulkWriter] = None,
+    lookups: Optional[LookupCache] = None,
+    **kwargs
+):
+    """Sets object attributes and creates child objects from parsed EU list data.
+    If writer is specified objects are added to the writer instead of saving them one by one.
+    SubjectType and RegulationSummary rows are looked up from lookups cache.
+    """
+    if lookups is None:
+        lookups = LookupCache()
     padding_str = " " * padding
-    obj.save()
+    if writer is None:
+        obj.save()
+    else:
+        writer.add(obj)
     obj2: Any
+    model = type(obj)
     for k0, v0 in data.items():
         if k0[0] == "@":
-            k = camel_case_to_underscore(k0[1:])
-            if k == "birthdate":
-                k = "birth_date"  # special case because class name same as attribute
-            if hasattr(obj, k):
-                set_eu_object_attr(obj, k, v0)
+            mapping = get_eu_attribute_mapping(model, k0)
+            if mapping is not None:
+                k, max_length = mapping
+                set_eu_object_attr(obj, k, v0, max_length)
                 if verbose:
                     logger.info("%s%s: %s = %s", padding_str, obj, k, v0)
-        elif k0 in class_map:
-            k = camel_case_to_underscore(k0)
-            if hasattr(obj, k):
+        elif k0 in EU_CLASS_MAP:
+            mapping = get_eu_attribute_mapping(model, k0)
+            if mapping is not None:
+                k = mapping[0]
                 if k == "subject_type":
-                    obj2 = SubjectType.objects.get_or_create(code=v0.get("@code", ""), classification_code=v0.get("@classificationCode", ""))[0]
+                    obj2 = lookups.get_or_create(SubjectType, **get_eu_subject_type_lookup(v0))[0]
                 elif k == "regulation_summary":
-                    obj2 = RegulationSummary.objects.get_or_create(
-                        regulation_type=v0.get("@regulationType", ""),
-                        publication_date=v0.get("@publicationDate", None),
-                        publication_url=v0.get("@publicationUrl", ""),
-                        number_title=v0.get("@numberTitle", ""),
-                    )[0]
+                    obj2 = lookups.get_or_create(RegulationSummary, **get_eu_regulation_summary_lookup(v0))[0]
                 else:
-                    obj2 = class_map[k0]()
+                    obj2 = EU_CLASS_MAP[k0]()
                     kwargs2 = {}
                     kwargs2[k] = obj2
                     for k2, v2 in kwargs.items():
                         set_eu_object_attr(obj2, k2, v2)
                         kwargs2[k2] = v2
 
-                    set_eu_members(obj2, v0, verbose=verbose, padding=padding + 4, **kwargs2)
+                    set_eu_members(obj2, v0, verbose=verbose, padding=padding + 4, writer=writer, lookups=lookups, **kwargs2)
 
                 set_eu_object_attr(obj, k, obj2)
-        elif k0 in array_class_map:
-            k = camel_case_to_underscore(k0)
-            cls = array_class_map[k0]
+        elif k0 in EU_ARRAY_CLASS_MAP:
+            k = EU_ARRAY_ATTRIBUTE_NAMES[k0]
+            cls = EU_ARRAY_CLASS_MAP[k0]
             for v0_data in v0:
                 obj2 = cls()
                 kwargs2 = {}
@@ -130,34 +218,83 @@ def set_eu_members(obj: Any, data: Dict[str, Any], verbose: bool = False, paddin
                 for k2, v2 in kwargs.items():
                     set_eu_object_attr(obj2, k2, v2)
                     kwargs2[k2] = v2
-                obj2.clean()
-                obj2.save()
-                set_eu_members(obj2, v0_data, verbose=verbose, padding=padding + 4, **kwargs2)
+                if writer is None:
+                    obj2.clean()
+                    obj2.save()
+                set_eu_members(obj2, v0_data, verbose=verbose, padding=padding + 4, writer=writer, lookups=lookups, **kwargs2)
         elif k0 == "remark":
             for v0_str in v0:
-                Remark.objects.create(text=v0_str, container=obj)
+                if writer is None:
+                    Remark.objects.create(text=v0_str, container=obj)
+                else:
+                    writer.add(Remark(text=v0_str, container=obj))
 
     obj.clean()
-    obj.save()
+    if writer is None:
+        obj.save()
     if verbose:
-        logger.info("%sSaved %s", padding * " ", obj)
+        logger.info("%s%s %s", padding * " ", "Saved" if writer is None else "Prepared", obj)
 
 
-def import_eu_sanctions(source: SanctionsListFile, verbose: bool = False):
-    data = load_eu_sanction_list_as_dict(source.full_path)
-    set_eu_members(source, data, verbose=verbose)
-    entities_list = data.get("sanctionEntity", [])
-    logger.info("Importing %s sanction entities from %s", len(entities_list), os.path.basename(source.file.name))
-    t0 = now()
-    for se_data in entities_list:
+def import_eu_sanction_entities(
+    source: SanctionsListFile,
+    items: List[Tuple[Dict[str, Any], str]],
+    verbose: bool = False,
+    loader: str = BULK_LOADER,
+    lookups: Optional[LookupCache] = None,
+):
+    """Imports a batch of parsed sanctionEntity (data, data hash) pairs in a single transaction."""
+    writer = create_bulk_writer(loader)
+    for se_data, data_hash in items:
+        se = SanctionEntity(source=source, data_hash=data_hash)
+        set_eu_members(se, se_data, verbose=verbose, padding=4, writer=writer, lookups=lookups, sanction=se)
+        save_sanction_entity_data(se, se_data, writer)
+    writer.flush()
+
+
+def iter_eu_sanction_records(source: SanctionsListFile, verbose: bool = False) -> Iterator[Tuple[Optional[int], str, Tuple[Dict[str, Any], str]]]:
+    """Yields (logical id, data hash, (data, data hash)) of sanctionEntity elements, see import_sanction_list_file().
+    Other top level elements are stored to the source."""
+    for tag, se_data in iter_eu_sanction_list(source.full_path):
+        if tag != "sanctionEntity":
+            set_eu_members(source, se_data, verbose=verbose)
+            continue
         assert isinstance(se_data, dict)
         if verbose:
             logger.info("  sanctionEntity")
-        with transaction.atomic():
-            se = SanctionEntity.objects.create(source=source, data=se_data)
-            set_eu_members(se, se_data, verbose=verbose, padding=4, sanction=se)
-    source.imported = now()
-    source.save()
-    msg = "Imported {} sanction entities from {} in {}".format(len(entities_list), source.full_path, source.imported - t0)
+        data_hash = get_data_hash(se_data)
+        yield se_data.get("@logicalId"), data_hash, (se_data, data_hash)
+
+
+def import_eu_sanctions(
+    source: SanctionsListFile,
+    verbose: bool = False,
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+    loader: str = BULK_LOADER,
+    incremental: bool = False,
+    workers: int = 0,
+    bisect: bool = False,
+    activate: bool = False,
+    complete: bool = True,
+) -> SanctionListImport:
+    """Imports EU sanction list file, see import_sanction_list_file() for the options."""
+    logger.info("Importing sanction entities from %s", os.path.basename(source.file.name))
+    t0 = now()
+    lookups = LookupCache()
+    imp = import_sanction_list_file(
+        source,
+        iter_eu_sanction_records(source, verbose),
+        import_eu_sanction_entities,
+        (verbose, loader, lookups),
+        prepare_batch=lambda items: lookups.create_missing(iter_eu_lookups(items)),
+        batch_size=batch_size,
+        incremental=incremental,
+        workers=workers,
+        bisect=bisect,
+        activate=activate,
+        complete=complete,
+    )
+    msg = "Imported {} sanction entities from {} in {}".format(imp.count, source.full_path, now() - t0)
     logger.info(msg)
     admin_log([source], msg)
+    return imp
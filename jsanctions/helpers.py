@@ -1,16 +1,160 @@
+import gzip
+import hashlib
+import json
 import logging
-from typing import Dict, Any, Callable, Optional
+import re
+import unicodedata
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Dict, Any, Callable, Optional, Iterable, Iterator, Tuple, List, Set, BinaryIO, ContextManager
+from xml.etree.ElementTree import Element, iterparse, parse
 import pytz
+from django.core.serializers.json import DjangoJSONEncoder
 
 logger = logging.getLogger(__name__)
 
+GZIP_COMPRESSION = "gzip"
+ZSTD_COMPRESSION = "zstd"
+COMPRESSION_EXTENSIONS = {GZIP_COMPRESSION: ".gz", ZSTD_COMPRESSION: ".zst"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
 
+
+# country name variants used in sanction lists (UN / ISO 3166 official names etc.) which differ from pytz.country_names
+COUNTRY_NAME_VARIANTS = {
+    "Bolivia (Plurinational State of)": "BO",
+    "Bosnia and Herzegovina": "BA",
+    "Brunei Darussalam": "BN",
+    "Burma": "MM",
+    "Cabo Verde": "CV",
+    "Congo": "CG",
+    "Republic of the Congo": "CG",
+    "Democratic Republic of the Congo": "CD",
+    "Congo, Democratic Republic of the": "CD",
+    "Cote d'Ivoire": "CI",
+    "Ivory Coast": "CI",
+    "Czechia": "CZ",
+    "Democratic People's Republic of Korea": "KP",
+    "Korea, Democratic People's Republic of": "KP",
+    "DPRK": "KP",
+    "North Korea": "KP",
+    "Republic of Korea": "KR",
+    "Korea, Republic of": "KR",
+    "South Korea": "KR",
+    "Eswatini": "SZ",
+    "Swaziland": "SZ",
+    "Holy See": "VA",
+    "Iran (Islamic Republic of)": "IR",
+    "Iran, Islamic Republic of": "IR",
+    "Islamic Republic of Iran": "IR",
+    "Lao People's Democratic Republic": "LA",
+    "Micronesia (Federated States of)": "FM",
+    "Myanmar": "MM",
+    "Republic of Moldova": "MD",
+    "Moldova, Republic of": "MD",
+    "The former Yugoslav Republic of Macedonia": "MK",
+    "Macedonia": "MK",
+    "State of Palestine": "PS",
+    "Occupied Palestinian Territory": "PS",
+    "Russian Federation": "RU",
+    "Saint Vincent and the Grenadines": "VC",
+    "Syrian Arab Republic": "SY",
+    "Turkiye": "TR",
+    "United Kingdom": "GB",
+    "United Kingdom of Great Britain and Northern Ireland": "GB",
+    "Great Britain": "GB",
+    "United Republic of Tanzania": "TZ",
+    "Tanzania, United Republic of": "TZ",
+    "United States of America": "US",
+    "USA": "US",
+    "Venezuela (Bolivarian Republic of)": "VE",
+    "Viet Nam": "VN",
+}
+
+
+def normalize_country_name(name: str) -> str:
+    """Returns country name in lowercase ASCII without punctuation, diacritics or leading/trailing article 'the'."""
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+    name = name.replace("&", " and ").replace("\u2019", "").replace("'", "")
+    words = re.sub(r"[^a-z0-9]+", " ", name).split()
+    words = ["saint" if w == "st" else w for w in words]
+    if words and words[0] == "the":
+        words = words[1:]
+    if words and words[-1] == "the":
+        words = words[:-1]
+    return " ".join(words)
+
+
+def build_country_iso2_code_index() -> Dict[str, str]:
+    """Returns normalized country name -> ISO 3166-1 alpha-2 code index of pytz country names and COUNTRY_NAME_VARIANTS."""
+    index: Dict[str, str] = {}
+    for code, name in list(pytz.country_names.items()) + [(v, k) for k, v in COUNTRY_NAME_VARIANTS.items()]:
+        index.setdefault(normalize_country_name(name), code)
+    return index
+
+
+COUNTRY_ISO2_CODES = build_country_iso2_code_index()
+
+
+@lru_cache(maxsize=4096)
 def get_country_iso2_code(country_description: str) -> str:
-    country = country_description.lower()
-    for k, v in pytz.country_names.items():
-        if v.lower() == country:
-            return k
-    return ""
+    """Returns ISO 3166-1 alpha-2 country code by (case-insensitive) country name or "" if not found."""
+    return COUNTRY_ISO2_CODES.get(normalize_country_name(country_description), "")
+
+
+def normalize_name(name: str) -> str:
+    """Returns lower case name with whitespace collapsed, matches lower() used by the NameAlias trigram indexes."""
+    return " ".join(name.lower().split())
+
+
+def get_data_hash(data: Any) -> str:
+    """Returns SHA-256 hex digest of JSON-serializable data. Dict key order does not affect the hash."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def _import_zstandard():
+    try:
+        import zstandard  # type: ignore  # pylint: disable=import-outside-toplevel
+
+        return zstandard
+    except ImportError as exc:
+        raise Exception("zstd compression requires zstandard package") from exc
+
+
+def open_compressed_file(filename: str) -> BinaryIO:
+    """Opens file for binary reading. gzip and zstd compressed files are detected
+    from the file header and decompressed transparently.
+    """
+    fp = open(filename, "rb")  # pylint: disable=consider-using-with
+    header = fp.read(4)
+    fp.seek(0)
+    if header.startswith(GZIP_MAGIC):
+        fp.close()
+        return gzip.open(filename, "rb")  # type: ignore
+    if header.startswith(ZSTD_MAGIC):
+        return _import_zstandard().ZstdDecompressor().stream_reader(fp, closefd=True)
+    return fp
+
+
+def open_compressed_writer(fp: BinaryIO, compression: str = "") -> ContextManager[BinaryIO]:
+    """Returns writer which optionally compresses data (gzip/zstd) to the file. The file itself is not closed."""
+    if not compression:
+        return nullcontext(fp)
+    if compression == GZIP_COMPRESSION:
+        return gzip.GzipFile(fileobj=fp, mode="wb")  # type: ignore
+    if compression == ZSTD_COMPRESSION:
+        return _import_zstandard().ZstdCompressor().stream_writer(fp, closefd=False)
+    raise Exception("Unsupported compression: {}".format(compression))
+
+
+def get_file_hash(filename: str, chunk_size: int = 1024 * 1024) -> str:
+    """Returns SHA-256 hex digest of (uncompressed) file contents. File is read in chunks."""
+    h = hashlib.sha256()
+    with open_compressed_file(filename) as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 def dict_filter_attributes(data: Dict[str, Any], fn: Optional[Callable[[str, Any], Any]] = None) -> Dict[str, Any]:
@@ -25,3 +169,108 @@ def dict_filter_attributes(data: Dict[str, Any], fn: Optional[Callable[[str, Any
                     v = fn(k, v)
             data[k] = v
     return data
+
+
+def _xml_strip_namespace(tag: str) -> str:
+    ns_end = tag.find("}")
+    return tag[ns_end + 1 :] if ns_end != -1 else tag
+
+
+def _xml_element_data(
+    el: Element, array_tags: Set[str], int_tags: Set[str], is_array: bool = False, attr_filter: Optional[Callable[[str, Any], Any]] = None
+) -> Any:
+    """Returns XML element data using the same conventions as jutil.xml.xml_to_dict.
+    If attr_filter is specified attribute values are converted with attr_filter(key, value) while building the data.
+    """
+    value: Any = None
+    if el.text is not None:
+        if not is_array and _xml_strip_namespace(el.tag) in int_tags:
+            try:
+                value = int(el.text)
+            except ValueError:
+                pass
+        if value is None:
+            value = el.text.strip() or None
+
+    children = list(el)
+    if not el.attrib and not children:
+        return value
+    obj: Dict[str, Any] = {} if value is None else {"@": value}
+    for a_key, a_val in el.attrib.items():
+        a_key = "@" + _xml_strip_namespace(a_key)
+        obj[a_key] = attr_filter(a_key, a_val) if attr_filter is not None else a_val
+    for el2 in children:
+        tag = _xml_strip_namespace(el2.tag)
+        if tag in obj or tag in array_tags:
+            obj.setdefault(tag, [])
+            if not isinstance(obj[tag], list):
+                obj[tag] = [obj[tag]]
+            obj2 = _xml_element_data(el2, array_tags, int_tags, is_array=True, attr_filter=attr_filter)
+            if obj2 is not None:
+                obj[tag].append(obj2)
+        else:
+            obj[tag] = _xml_element_data(el2, array_tags, int_tags, attr_filter=attr_filter)
+    return obj
+
+
+def load_xml_as_dict(
+    filename: str,
+    array_tags: Optional[Iterable[str]] = None,
+    int_tags: Optional[Iterable[str]] = None,
+    attr_filter: Optional[Callable[[str, Any], Any]] = None,
+) -> Dict[str, Any]:
+    """Parses whole XML file to dict using the same conventions as jutil.xml.xml_to_dict.
+    Attribute values are converted with attr_filter(key, value) during parsing (see dict_filter_attributes).
+    """
+    with open_compressed_file(filename) as fp:
+        root = parse(fp).getroot()
+    return _xml_element_data(root, set(array_tags or []), set(int_tags or []), attr_filter=attr_filter)
+
+
+def iterparse_xml_elements(
+    filename: str,
+    tags: Iterable[str],
+    array_tags: Optional[Iterable[str]] = None,
+    int_tags: Optional[Iterable[str]] = None,
+    attr_filter: Optional[Callable[[str, Any], Any]] = None,
+) -> Iterator[Tuple[str, Any]]:
+    """Parses XML file incrementally and yields (tag, data) pair for each element in tags
+    as soon as the closing tag of the element is seen. Element data is converted the same way as
+    in jutil.xml.xml_to_dict. Root element attributes are yielded first as (root tag, attributes dict).
+    Parsed elements are released after use so memory usage stays constant regardless of file size.
+
+    Args:
+        filename: XML file name
+        tags: Tags to yield (elements nested inside yielded elements are part of the yielded data)
+        array_tags: Tags that should be treated as arrays by default
+        int_tags: Tags that should be treated as ints
+        attr_filter: Optional attribute value converter called as attr_filter(key, value) during parsing
+
+    Returns:
+        Iterator of (tag, data) pairs
+    """
+    tags_set = set(tags)
+    array_tags_set = set(array_tags or [])
+    int_tags_set = set(int_tags or [])
+    stack: List[Element] = []
+    capture_depth = 0
+    with open_compressed_file(filename) as fp:
+        for event, el in iterparse(fp, events=("start", "end")):
+            tag = _xml_strip_namespace(el.tag)
+            if event == "start":
+                if not stack:
+                    attrs = {"@" + _xml_strip_namespace(k): v for k, v in el.attrib.items()}
+                    yield tag, {k: attr_filter(k, v) for k, v in attrs.items()} if attr_filter is not None else attrs
+                if tag in tags_set:
+                    capture_depth += 1
+                stack.append(el)
+                continue
+
+            stack.pop()
+            if tag in tags_set:
+                capture_depth -= 1
+                if capture_depth == 0:
+                    yield tag, _xml_element_data(el, array_tags_set, int_tags_set, attr_filter=attr_filter)
+            if capture_depth == 0 and stack:
+                el.clear()
+                stack[-1].remove(el)
@@ -8,13 +8,14 @@ class CustomHttpAdapter(requests.adapters.HTTPAdapter):
         self.ssl_context = ssl_context
         super().__init__(**kwargs)
 
-    def init_poolmanager(self, connections, maxsize, block=False):  # noqa
-        self.poolmanager = urllib3.poolmanager.PoolManager(num_pools=connections, maxsize=maxsize, block=block, ssl_context=self.ssl_context)
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):  # noqa
+        self.poolmanager = urllib3.poolmanager.PoolManager(num_pools=connections, maxsize=maxsize, block=block, ssl_context=self.ssl_context, **pool_kwargs)
 
 
-def get_legacy_session():
+def get_legacy_session(**adapter_kwargs):
+    """Returns session which allows legacy TLS renegotiation. Optional adapter_kwargs are passed to HTTPAdapter (e.g. max_retries)."""
     ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
     ctx.options |= 0x4  # OP_LEGACY_SERVER_CONNECT
     session = requests.session()
-    session.mount("https://", CustomHttpAdapter(ctx))
+    session.mount("https://", CustomHttpAdapter(ctx, **adapter_kwargs))
     return session
@@ -0,0 +1,36 @@
+import logging
+from django.core.management.base import CommandParser
+from jutil.command import SafeCommand
+from jsanctions.models import ActiveSanctionsList
+from jsanctions.services import delete_old_sanction_list_files, get_old_sanction_list_files, DEFAULT_PURGE_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(SafeCommand):
+    help = "Deletes sanction list files which are not active, e.g. old list versions left by imports without --delete-old"
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--list-type", type=str, help="List type to purge, all list types with active files by default")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_PURGE_CHUNK_SIZE, help="Number of sanction entities deleted per transaction")
+        parser.add_argument("--verbose", action="store_true")
+
+    def do(self, *args, **options):
+        qs = ActiveSanctionsList.objects.all()
+        if options["list_type"]:
+            qs = qs.filter(list_type=options["list_type"])
+        for active in qs.order_by("list_type"):
+            assert isinstance(active, ActiveSanctionsList)
+            sources = list(active.sources.all())
+            if not sources:
+                print("{}: no active files, skipped".format(active.list_type))
+                continue
+            # files created after the activation and not imported yet may be imports in progress
+            old_count = get_old_sanction_list_files(active.list_type, sources, keep_created_after=active.activated).count()
+            print("{}: deleting {} inactive files".format(active.list_type, old_count))
+
+            def progress(deleted: int, total: int):
+                if options["verbose"]:
+                    print("{}: {}/{} sanction entities deleted".format(active.list_type, deleted, total))  # pylint: disable=cell-var-from-loop
+
+            delete_old_sanction_list_files(active.list_type, sources, chunk_size=options["chunk_size"], progress=progress, keep_created_after=active.activated)
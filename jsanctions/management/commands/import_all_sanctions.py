@@ -0,0 +1,93 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import import_module
+from typing import List, Tuple, Dict
+import django
+from django.core.management import call_command
+from django.core.management.base import CommandParser
+from django.db import connections
+from jutil.command import SafeCommand
+from jsanctions.eu import EU_LIST_TYPE
+from jsanctions.management.import_options import add_import_arguments, get_import_command_args
+from jsanctions.services import delete_old_sanction_list_files
+from jsanctions.models import SanctionsListFile
+from jsanctions.ofac import OFAC_LIST_TYPE
+from jsanctions.un import UN_LIST_TYPE
+
+logger = logging.getLogger(__name__)
+
+IMPORT_COMMANDS = {
+    EU_LIST_TYPE: "import_eu_sanctions",
+    OFAC_LIST_TYPE: "import_ofac_sanctions",
+    UN_LIST_TYPE: "import_un_sanctions",
+}
+
+
+def run_import_command(command_name: str, args: List[str]) -> Tuple[float, List[int]]:
+    """Runs sanction list import command in a worker process.
+    Returns elapsed time in seconds and ids of the files retained after the import.
+    """
+    django.setup()
+    connections.close_all()
+    cmd = import_module("jsanctions.management.commands." + command_name).Command()  # type: ignore
+    time_begin = time.monotonic()
+    try:
+        call_command(cmd, *args)
+    finally:
+        connections.close_all()
+    return time.monotonic() - time_begin, [e.id for e in cmd.retained_sources]
+
+
+class Command(SafeCommand):
+    help = "Downloads and imports EU, OFAC and UN sanction lists in parallel worker processes"
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--eu-url", type=str, help="EU consolidated list URL, EU list is skipped if not set")
+        parser.add_argument("--lists", type=str, nargs="+", choices=list(IMPORT_COMMANDS), default=list(IMPORT_COMMANDS))
+        add_import_arguments(parser)
+
+    def get_command_args(self, list_type: str, **options) -> List[str]:
+        args = ["--url", options["eu_url"]] if list_type == EU_LIST_TYPE else ["--url-defaults"]
+        return args + get_import_command_args(options)
+
+    def do(self, *args, **options):
+        list_types = list(options["lists"])
+        if EU_LIST_TYPE in list_types and not options["eu_url"]:
+            print("{} skipped, --eu-url not set".format(EU_LIST_TYPE))
+            list_types.remove(EU_LIST_TYPE)
+        if not list_types:
+            print("Nothing to import")
+            return
+
+        # forked workers must not share the parent database connection
+        connections.close_all()
+        start_methods = multiprocessing.get_all_start_methods()
+        mp_context = multiprocessing.get_context("fork" if "fork" in start_methods else "spawn")
+        time_begin = time.monotonic()
+        errors: Dict[str, Exception] = {}
+        retained: Dict[str, List[int]] = {}
+        with ProcessPoolExecutor(max_workers=len(list_types), mp_context=mp_context) as executor:
+            futures = {
+                list_type: executor.submit(run_import_command, IMPORT_COMMANDS[list_type], self.get_command_args(list_type, **options))
+                for list_type in list_types
+            }
+            for list_type, future in futures.items():
+                try:
+                    elapsed, retained[list_type] = future.result()
+                    print("{}: {:.1f}s".format(list_type, elapsed))
+                except Exception as exc:
+                    errors[list_type] = exc
+                    print("{}: FAILED: {}".format(list_type, exc))
+        print("Total: {:.1f}s".format(time.monotonic() - time_begin))
+
+        if errors:
+            raise Exception("Import failed: {}".format(", ".join(errors)))
+
+        if options["delete_old"]:
+            for list_type in list_types:
+                if retained[list_type]:
+                    delete_old_sanction_list_files(
+                        list_type, list(SanctionsListFile.objects.filter(id__in=retained[list_type])), chunk_size=options["delete_chunk_size"]
+                    )
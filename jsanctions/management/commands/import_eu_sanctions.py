@@ -1,10 +1,15 @@
 import logging
-from typing import Optional
+from typing import Optional, List
 from django.core.management.base import CommandParser
 from django.utils.timezone import now
-from jsanctions.eu import import_eu_sanctions, EU_LIST_TYPE
+from jsanctions.eu import import_eu_sanctions, EU_LIST_TYPE, read_eu_generation_date
 from jutil.command import SafeCommand
-from jsanctions.services import delete_old_sanction_list_files
+from jsanctions.management.import_options import add_import_arguments, get_import_kwargs, is_input_file
+from jsanctions.services import (
+    delete_old_sanction_list_files,
+    discard_already_imported_sanction_list_file,
+    activate_sanction_list_files,
+)
 from jsanctions.models import SanctionsListFile
 
 logger = logging.getLogger(__name__)
@@ -12,25 +17,27 @@ logger = logging.getLogger(__name__)
 
 class Command(SafeCommand):
     help = "Imports EU consolidated sanction lists"
+    retained_sources: List[SanctionsListFile]  # current files of the list type after import, see delete_old_sanction_list_files()
 
     def add_arguments(self, parser: CommandParser):
         parser.add_argument("--url", type=str)
         parser.add_argument("--file", type=str)
-        parser.add_argument("--delete-old", action="store_true")
+        add_import_arguments(parser)
         parser.add_argument("--source", type=int)
         parser.add_argument("--new", action="store_true")
-        parser.add_argument("--verbose", action="store_true")
 
     def do(self, *args, **options):  # pylint: disable=too-many-branches
+        self.retained_sources = []
         list_type = EU_LIST_TYPE
-        verbose = options["verbose"]
         source: Optional[SanctionsListFile] = None
         if options["url"]:
             url = options["url"]
             filename = options["file"] if options["file"] else "{}-consolidated-{}.xml".format(list_type, now().date().isoformat())
-            source = SanctionsListFile.objects.create_from_url(url, filename, list_type=list_type)
+            source = SanctionsListFile.objects.create_from_url(
+                url, filename, conditional=not options["force"], compression=options["compress"], list_type=list_type
+            )
         elif options["file"]:
-            source = SanctionsListFile.objects.create_from_filename(options["file"], list_type=list_type)
+            source = SanctionsListFile.objects.create_from_filename(options["file"], compression=options["compress"], list_type=list_type)
         elif options["source"]:
             source = SanctionsListFile.objects.get(id=options["source"])
         elif options["new"]:
@@ -40,7 +47,21 @@ class Command(SafeCommand):
             return
 
         assert isinstance(source, SanctionsListFile)
-        import_eu_sanctions(source, verbose=verbose)
+        if (options["url"] or options["file"]) and not options["force"]:
+            generation_date = read_eu_generation_date(source.full_path) if options["skip_same_date"] else None
+            previous = discard_already_imported_sanction_list_file(source, generation_date, keep_file=is_input_file(source, options))
+            if previous is not None:
+                self.retained_sources = [previous]
+                activate_sanction_list_files(list_type, self.retained_sources)
+                print("Already imported")
+                return
+
+        import_eu_sanctions(
+            source,
+            **get_import_kwargs(options),
+            activate=True,
+        )
+        self.retained_sources = [source]
 
         if options["delete_old"]:
-            delete_old_sanction_list_files(list_type, [source])
+            delete_old_sanction_list_files(list_type, self.retained_sources, chunk_size=options["delete_chunk_size"])
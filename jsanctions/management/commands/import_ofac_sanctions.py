@@ -1,59 +1,92 @@
 import logging
 import os
-from typing import Optional
+from typing import Optional, List
 from django.core.management.base import CommandParser
 from django.utils.timezone import now
 from jutil.command import SafeCommand
-from jsanctions.services import delete_old_sanction_list_files
+from jsanctions.management.import_options import add_import_arguments, get_import_kwargs, is_input_file
+from jsanctions.services import (
+    delete_old_sanction_list_files,
+    discard_already_imported_sanction_list_file,
+    complete_sanction_list_imports,
+)
 from jsanctions.models import SanctionsListFile
-from jsanctions.ofac import OFAC_LIST_TYPE, import_ofac_sanctions
+from jsanctions.ofac import OFAC_LIST_TYPE, import_ofac_sanctions, read_ofac_generation_date
 
 logger = logging.getLogger(__name__)
 
 
 class Command(SafeCommand):
     help = "Imports OFAC consolidated sanction lists, both SDN and non-SDN supported"
+    retained_sources: List[SanctionsListFile]  # current files of the list type after import, see delete_old_sanction_list_files()
 
     def add_arguments(self, parser: CommandParser):
         parser.add_argument("--url", type=str)
         parser.add_argument("--file", type=str)
-        parser.add_argument("--delete-old", action="store_true")
+        add_import_arguments(parser)
         parser.add_argument("--source", type=int)
         parser.add_argument("--new", action="store_true")
-        parser.add_argument("--verbose", action="store_true")
         parser.add_argument("--url-defaults", action="store_true")
 
     def do(self, *args, **options):  # pylint: disable=too-many-branches
-        verbose = options["verbose"]
+        self.retained_sources = []
         source: Optional[SanctionsListFile] = None
+        new_sources: List[SanctionsListFile] = []
+        unchanged: List[SanctionsListFile] = []
         list_type = OFAC_LIST_TYPE
         if options["url"]:
             url = options["url"]
             filename = options["file"] if options["file"] else "{}-{}-{}.xml".format(list_type, os.path.basename(url)[:-4], now().date().isoformat())
-            source = SanctionsListFile.objects.create_from_url(url, filename, list_type=list_type)
+            source = SanctionsListFile.objects.create_from_url(
+                url, filename, conditional=not options["force"], compression=options["compress"], list_type=list_type
+            )
         elif options["file"]:
-            source = SanctionsListFile.objects.create_from_filename(options["file"], list_type=list_type)
+            source = SanctionsListFile.objects.create_from_filename(options["file"], compression=options["compress"], list_type=list_type)
         elif options["source"]:
             source = SanctionsListFile.objects.get(id=options["source"])
         elif options["new"]:
             source = SanctionsListFile.objects.filter(imported=None).order_by("id").first()
-        sources = [source] if source else []
+        sources: List[SanctionsListFile] = []
+        if source is not None:
+            if options["url"] or options["file"]:
+                new_sources.append(source)
+            else:
+                sources.append(source)
         if options["url_defaults"]:
             urls = [
                 "https://www.treasury.gov/ofac/downloads/consolidated/consolidated.xml",
                 "https://www.treasury.gov/ofac/downloads/sdn.xml",
             ]
-            for url in urls:
-                filename = "{}-{}-{}.xml".format(list_type, os.path.basename(url)[:-4], now().date().isoformat())
-                source = SanctionsListFile.objects.create_from_url(url, filename, list_type=list_type)
+            url_filenames = [(url, "{}-{}-{}.xml".format(list_type, os.path.basename(url)[:-4], now().date().isoformat())) for url in urls]
+            downloaded = SanctionsListFile.objects.create_from_urls(
+                url_filenames, conditional=not options["force"], compression=options["compress"], list_type=list_type
+            )
+            for url, source in zip(urls, downloaded):
+                if source is not None:
+                    new_sources.append(source)
+                else:
+                    previous = SanctionsListFile.objects.get_latest_imported_from_url(url)
+                    if previous is not None:
+                        unchanged.append(previous)
+        for source in new_sources:
+            generation_date = read_ofac_generation_date(source.full_path) if options["skip_same_date"] else None
+            previous = (
+                discard_already_imported_sanction_list_file(source, generation_date, keep_file=is_input_file(source, options))
+                if not options["force"]
+                else None
+            )
+            if previous is not None:
+                unchanged.append(previous)
+            else:
                 sources.append(source)
         if not sources:
             print("Nothing to import")
             return
 
-        for source in sources:
-            assert isinstance(source, SanctionsListFile)
-            import_ofac_sanctions(source, verbose=verbose)
+        # unchanged entities are moved to the new files and the files activated in a single transaction once all files have been imported
+        imports = [import_ofac_sanctions(source, complete=False, **get_import_kwargs(options)) for source in sources]
+        self.retained_sources = sources + unchanged
+        complete_sanction_list_imports(imports, self.retained_sources)
 
         if options["delete_old"]:
-            delete_old_sanction_list_files(list_type, sources)
+            delete_old_sanction_list_files(list_type, self.retained_sources, chunk_size=options["delete_chunk_size"])
@@ -1,38 +1,45 @@
 import logging
 import os
-from typing import Optional
+from typing import Optional, List
 from django.core.management.base import CommandParser
 from django.utils.timezone import now
 from jutil.command import SafeCommand
-from jsanctions.services import delete_old_sanction_list_files
+from jsanctions.management.import_options import add_import_arguments, get_import_kwargs, is_input_file
+from jsanctions.services import (
+    delete_old_sanction_list_files,
+    discard_already_imported_sanction_list_file,
+    activate_sanction_list_files,
+)
 from jsanctions.models import SanctionsListFile
-from jsanctions.un import UN_LIST_TYPE, import_un_sanctions
+from jsanctions.un import UN_LIST_TYPE, import_un_sanctions, read_un_generation_date
 
 logger = logging.getLogger(__name__)
 
 
 class Command(SafeCommand):
     help = "Imports U consolidated sanction lists"
+    retained_sources: List[SanctionsListFile]  # current files of the list type after import, see delete_old_sanction_list_files()
 
     def add_arguments(self, parser: CommandParser):
         parser.add_argument("--url", type=str)
         parser.add_argument("--file", type=str)
-        parser.add_argument("--delete-old", action="store_true")
+        add_import_arguments(parser)
         parser.add_argument("--source", type=int)
         parser.add_argument("--new", action="store_true")
-        parser.add_argument("--verbose", action="store_true")
         parser.add_argument("--url-defaults", action="store_true")
 
     def do(self, *args, **options):  # pylint: disable=too-many-branches
-        verbose = options["verbose"]
+        self.retained_sources = []
         source: Optional[SanctionsListFile] = None
         list_type = UN_LIST_TYPE
         if options["url"]:
             url = options["url"]
             filename = options["file"] if options["file"] else "{}-{}-{}.xml".format(list_type, os.path.basename(url)[:-4], now().date().isoformat())
-            source = SanctionsListFile.objects.create_from_url(url, filename, list_type=list_type)
+            source = SanctionsListFile.objects.create_from_url(
+                url, filename, conditional=not options["force"], compression=options["compress"], list_type=list_type
+            )
         elif options["file"]:
-            source = SanctionsListFile.objects.create_from_filename(options["file"], list_type=list_type)
+            source = SanctionsListFile.objects.create_from_filename(options["file"], compression=options["compress"], list_type=list_type)
         elif options["source"]:
             source = SanctionsListFile.objects.get(id=options["source"])
         elif options["new"]:
@@ -40,13 +47,29 @@ class Command(SafeCommand):
         if options["url_defaults"]:
             url = "https://scsanctions.un.org/resources/xml/en/consolidated.xml"
             filename = "{}-{}-{}.xml".format(list_type, os.path.basename(url)[:-4], now().date().isoformat())
-            source = SanctionsListFile.objects.create_from_url(url, filename, legacy_ssl=True, list_type=list_type)
+            source = SanctionsListFile.objects.create_from_url(
+                url, filename, legacy_ssl=True, conditional=not options["force"], compression=options["compress"], list_type=list_type
+            )
         if not source:
             print("Nothing to import")
             return
 
         assert isinstance(source, SanctionsListFile)
-        import_un_sanctions(source, verbose=verbose)
+        if (options["url"] or options["file"] or options["url_defaults"]) and not options["force"]:
+            generation_date = read_un_generation_date(source.full_path) if options["skip_same_date"] else None
+            previous = discard_already_imported_sanction_list_file(source, generation_date, keep_file=is_input_file(source, options))
+            if previous is not None:
+                self.retained_sources = [previous]
+                activate_sanction_list_files(list_type, self.retained_sources)
+                print("Already imported")
+                return
+
+        import_un_sanctions(
+            source,
+            **get_import_kwargs(options),
+            activate=True,
+        )
+        self.retained_sources = [source]
 
         if options["delete_old"]:
-            delete_old_sanction_list_files(list_type, [source])
+            delete_old_sanction_list_files(list_type, self.retained_sources, chunk_size=options["delete_chunk_size"])
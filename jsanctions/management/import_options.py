@@ -0,0 +1,58 @@
+import os
+from typing import Any, Dict, List, Tuple
+from django.core.management.base import CommandParser
+from jsanctions.bulk import LOADERS, BULK_LOADER, DEFAULT_IMPORT_BATCH_SIZE
+from jsanctions.helpers import COMPRESSION_EXTENSIONS
+from jsanctions.models import SanctionsListFile
+from jsanctions.services import DEFAULT_PURGE_CHUNK_SIZE
+
+# options passed on to the import commands by import_all_sanctions
+IMPORT_ARGUMENTS: List[Tuple[str, Dict[str, Any]]] = [
+    ("--verbose", {"action": "store_true"}),
+    ("--loader", {"type": str, "choices": LOADERS, "default": BULK_LOADER}),
+    ("--incremental", {"action": "store_true"}),
+    ("--batch-size", {"type": int, "default": DEFAULT_IMPORT_BATCH_SIZE, "help": "Number of sanction entities imported per transaction"}),
+    ("--bisect-errors", {"action": "store_true", "help": "Split failing batches to isolate and skip invalid records"}),
+    ("--workers", {"type": int, "default": 0, "help": "Number of worker processes used to import batches in parallel"}),
+    ("--compress", {"type": str, "choices": list(COMPRESSION_EXTENSIONS), "default": "", "help": "Store downloaded file compressed"}),
+    ("--force", {"action": "store_true", "help": "Import even if the same file has already been imported"}),
+    ("--skip-same-date", {"action": "store_true", "help": "Skip import if the same generation date has already been imported"}),
+]
+
+
+def add_import_arguments(parser: CommandParser):
+    """Adds options common to all sanction list import commands."""
+    parser.add_argument("--delete-old", action="store_true", help="Delete old files of the list type after import")
+    parser.add_argument("--delete-chunk-size", type=int, default=DEFAULT_PURGE_CHUNK_SIZE, help="Number of old sanction entities deleted per transaction")
+    for name, kwargs in IMPORT_ARGUMENTS:
+        parser.add_argument(name, **kwargs)
+
+
+def get_import_kwargs(options: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns import_*_sanctions() keyword arguments from command options."""
+    return {
+        "verbose": options["verbose"],
+        "loader": options["loader"],
+        "incremental": options["incremental"],
+        "workers": options["workers"],
+        "batch_size": options["batch_size"],
+        "bisect": options["bisect_errors"],
+    }
+
+
+def get_import_command_args(options: Dict[str, Any]) -> List[str]:
+    """Returns command line arguments of IMPORT_ARGUMENTS options for calling an import command."""
+    args: List[str] = []
+    for name, kwargs in IMPORT_ARGUMENTS:
+        value = options[name[2:].replace("-", "_")]
+        if kwargs.get("action") == "store_true":
+            if value:
+                args.append(name)
+        elif value not in (None, ""):
+            args += [name, str(value)]
+    return args
+
+
+def is_input_file(source: SanctionsListFile, options: Dict[str, Any]) -> bool:
+    """Returns True if the source file is the --file input used as is (see create_from_filename), i.e. must not be deleted."""
+    return bool(options.get("file")) and os.path.realpath(source.full_path) == os.path.realpath(options["file"])
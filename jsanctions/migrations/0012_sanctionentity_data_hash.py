@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:18
+
+from django.db import migrations
+import jutil.modelfields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0011_auto_20210317_0320"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sanctionentity",
+            name="data_hash",
+            field=jutil.modelfields.SafeCharField(blank=True, default="", editable=False, max_length=64, verbose_name="data hash"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:21
+
+from django.db import migrations
+import jutil.modelfields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0012_sanctionentity_data_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sanctionslistfile",
+            name="content_hash",
+            field=jutil.modelfields.SafeCharField(blank=True, db_index=True, default="", editable=False, max_length=64, verbose_name="content hash"),
+        ),
+    ]
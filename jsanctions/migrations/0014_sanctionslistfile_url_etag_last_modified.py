@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:22
+
+from django.db import migrations, models
+import jutil.modelfields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0013_sanctionslistfile_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sanctionslistfile",
+            name="etag",
+            field=jutil.modelfields.SafeCharField(blank=True, default="", editable=False, max_length=256, verbose_name="ETag"),
+        ),
+        migrations.AddField(
+            model_name="sanctionslistfile",
+            name="last_modified",
+            field=jutil.modelfields.SafeCharField(blank=True, default="", editable=False, max_length=64, verbose_name="last modified"),
+        ),
+        migrations.AddField(
+            model_name="sanctionslistfile",
+            name="url",
+            field=models.URLField(blank=True, db_index=True, default="", editable=False, max_length=512, verbose_name="url"),
+        ),
+    ]
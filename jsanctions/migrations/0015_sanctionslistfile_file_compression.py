@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:25
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0014_sanctionslistfile_url_etag_last_modified"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="sanctionslistfile",
+            name="file",
+            field=models.FileField(upload_to="uploads", validators=[django.core.validators.FileExtensionValidator(["xml", "gz", "zst"])], verbose_name="file"),
+        ),
+    ]
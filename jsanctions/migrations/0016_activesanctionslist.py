@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:48
+
+import os
+import re
+from django.db import migrations, models
+import django.utils.timezone
+import jutil.modelfields
+
+
+def get_file_role(list_type: str, name: str, url: str) -> str:
+    # generated file names are {list_type}-{url basename}-{date}.xml, url was not stored before 0014
+    base = re.sub(r"(-\d{4}-\d{2}-\d{2})?(_[A-Za-z0-9]{7})?$", "", os.path.basename(name).split(".")[0])
+    return base if base.startswith(list_type + "-") else url
+
+
+def activate_latest_imported_files(apps, schema_editor):
+    # latest imported file of each list type and file role (e.g. OFAC sdn.xml and consolidated.xml)
+    SanctionsListFile = apps.get_model("jsanctions", "SanctionsListFile")
+    ActiveSanctionsList = apps.get_model("jsanctions", "ActiveSanctionsList")
+    latest = {}
+    for e in SanctionsListFile.objects.filter(imported__isnull=False).order_by("imported"):
+        latest[(e.list_type, get_file_role(e.list_type, e.file.name, e.url))] = e
+    for (list_type, role), e in latest.items():
+        active = ActiveSanctionsList.objects.get_or_create(list_type=list_type)[0]
+        active.sources.add(e)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0015_sanctionslistfile_file_compression"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActiveSanctionsList",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("list_type", jutil.modelfields.SafeCharField(max_length=128, unique=True, verbose_name="list type")),
+                ("activated", models.DateTimeField(blank=True, default=django.utils.timezone.now, editable=False, verbose_name="activated")),
+                ("sources", models.ManyToManyField(blank=True, related_name="active_lists", to="jsanctions.sanctionslistfile", verbose_name="sources")),
+            ],
+            options={
+                "verbose_name": "active sanction list",
+                "verbose_name_plural": "active sanction lists",
+            },
+        ),
+        migrations.RunPython(activate_latest_imported_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0016_activesanctionslist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SanctionEntityData",
+            fields=[
+                (
+                    "entity",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="raw_data",
+                        serialize=False,
+                        to="jsanctions.sanctionentity",
+                        verbose_name="sanction entity",
+                    ),
+                ),
+                ("blob", models.BinaryField(verbose_name="compressed data")),
+            ],
+            options={
+                "verbose_name": "sanction entity data",
+                "verbose_name_plural": "sanction entity data",
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+import logging
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+NAME_ALIAS_TRIGRAM_INDEXES = [
+    ("jsanctions_namealias_whole_name_trgm", "whole_name"),
+    ("jsanctions_namealias_first_name_trgm", "first_name"),
+    ("jsanctions_namealias_last_name_trgm", "last_name"),
+]
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # trigram name search is PostgreSQL only, see SanctionEntityQuerySet.search_name()
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            logger.warning("pg_trgm extension not available, NameAlias trigram indexes not created")
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, column in NAME_ALIAS_TRIGRAM_INDEXES:
+        schema_editor.execute("CREATE INDEX IF NOT EXISTS {} ON jsanctions_namealias USING gin (lower({}) gin_trgm_ops)".format(name, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, column in NAME_ALIAS_TRIGRAM_INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("jsanctions", "0017_sanctionentitydata"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
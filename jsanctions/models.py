@@ -1,21 +1,27 @@
+import hashlib
 import logging
 import os
-import requests
+import tempfile
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 from django.core.files import File
-from django.core.files.base import ContentFile
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, connections, transaction
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models.functions import Greatest, Lower
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from jutil.format import is_media_full_path, strip_media_root, get_media_full_path
 from jutil.modelfields import SafeCharField, SafeTextField
-from jsanctions.helpers import get_country_iso2_code
-from jsanctions.legacy_ssl import get_legacy_session
+from jsanctions.helpers import get_country_iso2_code, get_file_hash, open_compressed_writer, normalize_name, COMPRESSION_EXTENSIONS
+from jsanctions.download import DOWNLOAD_CHUNK_SIZE, DownloadManager, DownloadRequest, DownloadedFile, get_download_manager
+from jsanctions.data_storage import decompress_data, read_data_archive
 
 logger = logging.getLogger(__name__)
 
 
+SANCTION_LIST_FILE_EXTENSIONS = ["xml"] + [ext.lstrip(".") for ext in COMPRESSION_EXTENSIONS.values()]
 REMARK_BRIEF_LENGTH = 128
 DEFAULT_DESCRIPTION_TYPE = {"blank": True, "max_length": 512, "default": ""}
 DEFAULT_REMARK_TYPE = {
@@ -31,6 +37,8 @@ LANGUAGE_CODE_TYPE = {"blank": True, "default": "", "max_length": 5}
 COUNTRY_CODE_TYPE = {"blank": True, "default": "", "max_length": 3}
 DEFAULT_BOOLEAN_TYPE = {"blank": True, "default": None, "null": True}
 DEFAULT_INT_TYPE = {"blank": True, "default": None, "null": True}
+DEFAULT_NAME_SIMILARITY = 0.3
+NAME_SEARCH_FIELDS = ["whole_name", "first_name", "last_name"]
 REGULATION_SUMMARY_TYPE = {
     "verbose_name": _("regulation summary"),
     "blank": True,
@@ -41,30 +49,107 @@ REGULATION_SUMMARY_TYPE = {
 
 
 class SanctionsListFileManager(models.Manager):
-    def create_from_filename(self, filename: str, **kwargs):
+    def create_from_chunks(self, filename: str, chunks: Iterable[bytes], compression: str = "", **kwargs):
+        """Writes sanction list file to storage from byte chunks without buffering the whole file in memory.
+        Content hash is computed from uncompressed data while writing.
+        If compression is 'gzip' or 'zstd' the stored file is compressed and file extension added accordingly.
+        """
+        h = hashlib.sha256()
+        with tempfile.TemporaryFile() as tmp:
+            with open_compressed_writer(tmp, compression) as out:  # type: ignore
+                for chunk in chunks:
+                    h.update(chunk)
+                    out.write(chunk)
+            tmp.seek(0)
+            plain_filename = os.path.basename(filename) + COMPRESSION_EXTENSIONS.get(compression, "")
+            file = self.create(content_hash=h.hexdigest(), **kwargs)
+            assert isinstance(file, SanctionsListFile)
+            file.file.save(plain_filename, File(tmp))
+        logger.info("%s written", file.file)
+        return file
+
+    def create_from_filename(self, filename: str, compression: str = "", **kwargs):
         full_path = os.path.realpath(filename)
-        file = self.create(**kwargs)
-        assert isinstance(file, SanctionsListFile)
         if is_media_full_path(full_path):
+            file = self.create(content_hash=get_file_hash(full_path), **kwargs)
+            assert isinstance(file, SanctionsListFile)
             file.file.name = strip_media_root(full_path)
             file.save()
             logger.info("%s used as is", file.file)
-        else:
-            with open(full_path, "rb") as fp:
-                plain_filename = os.path.basename(filename)
-                file.file.save(plain_filename, File(fp))
-            logger.info("%s written", file.file)
-        return file
-
-    def create_from_url(self, url: str, filename: str, legacy_ssl: bool = False, **kwargs):
-        res = get_legacy_session().get(url) if legacy_ssl else requests.get(url)
-        body = res.content
-        plain_filename = os.path.basename(filename)
-        file = self.create(**kwargs)
-        file.file.save(plain_filename, ContentFile(body))
+            return file
+        with open(full_path, "rb") as fp:
+            return self.create_from_chunks(filename, iter(lambda: fp.read(DOWNLOAD_CHUNK_SIZE), b""), compression=compression, **kwargs)
+
+    def get_latest_imported_from_url(self, url: str):
+        return self.filter(url=url, imported__isnull=False).order_by("-imported").first()
+
+    def get_conditional_headers(self, url: str) -> Dict[str, str]:
+        """Returns If-None-Match / If-Modified-Since headers based on the latest imported file from the URL."""
+        headers: Dict[str, str] = {}
+        prev = self.get_latest_imported_from_url(url)
+        if prev is not None:
+            assert isinstance(prev, SanctionsListFile)
+            if prev.etag:
+                headers["If-None-Match"] = prev.etag
+            if prev.last_modified:
+                headers["If-Modified-Since"] = prev.last_modified
+        return headers
+
+    def create_from_download(self, download: DownloadedFile, filename: str, **kwargs):
+        """Creates sanction list file from downloaded temporary file. Temporary file is closed."""
+        assert download.file is not None
+        try:
+            file = self.create(content_hash=download.content_hash, url=download.url, etag=download.etag, last_modified=download.last_modified, **kwargs)
+            assert isinstance(file, SanctionsListFile)
+            file.file.save(os.path.basename(filename), File(download.file))
+        finally:
+            download.close()
         logger.info("%s written", file.file)
         return file
 
+    def create_from_urls(
+        self,
+        url_filenames: Sequence[Tuple[str, str]],
+        legacy_ssl: bool = False,
+        conditional: bool = True,
+        compression: str = "",
+        downloader: Optional[DownloadManager] = None,
+        **kwargs
+    ) -> List[Optional["SanctionsListFile"]]:
+        """Downloads sanction list files from (url, filename) pairs concurrently, see DownloadManager.
+        Returns list of created files in the same order, None for URLs which were not modified (see create_from_url).
+        """
+        if downloader is None:
+            downloader = get_download_manager()
+        reqs = [
+            DownloadRequest(url, self.get_conditional_headers(url) if conditional else {}, legacy_ssl=legacy_ssl, compression=compression)
+            for url, _filename in url_filenames
+        ]
+        ext = COMPRESSION_EXTENSIONS.get(compression, "")
+        files: List[Optional[SanctionsListFile]] = []
+        for download, (_url, filename) in zip(downloader.fetch_all(reqs), url_filenames):
+            files.append(None if download.not_modified else self.create_from_download(download, filename + ext, **kwargs))
+        return files
+
+    def create_from_url(
+        self,
+        url: str,
+        filename: str,
+        legacy_ssl: bool = False,
+        conditional: bool = True,
+        compression: str = "",
+        downloader: Optional[DownloadManager] = None,
+        **kwargs
+    ):
+        """Downloads sanction list file from URL.
+        Response is requested gzip-encoded and streamed to a temporary file in chunks before saving to storage.
+        If conditional is True and the server responds 304 Not Modified to the ETag / Last-Modified
+        values of the latest imported file from the same URL then nothing is downloaded and None is returned.
+        """
+        return self.create_from_urls(
+            [(url, filename)], legacy_ssl=legacy_ssl, conditional=conditional, compression=compression, downloader=downloader, **kwargs
+        )[0]
+
 
 class SanctionListObject(models.Model):
     pass
@@ -75,9 +160,13 @@ class SanctionsListFile(SanctionListObject):
     created = models.DateTimeField(verbose_name=_("created"), default=now, blank=True, editable=False, db_index=True)
     imported = models.DateTimeField(verbose_name=_("imported"), default=None, null=True, blank=True, editable=False, db_index=True)
     generation_date = models.DateField(verbose_name=_("generation date"), default=None, blank=True, null=True, editable=False, db_index=True)
-    file = models.FileField(verbose_name=_("file"), upload_to="uploads", validators=[FileExtensionValidator(["xml"])])
+    file = models.FileField(verbose_name=_("file"), upload_to="uploads", validators=[FileExtensionValidator(SANCTION_LIST_FILE_EXTENSIONS)])
     list_type = SafeCharField(verbose_name=_("list type"), max_length=128, db_index=True)
     global_file_id = SafeCharField(verbose_name=_("global file id"), **DEFAULT_DESCRIPTION_TYPE)  # type: ignore
+    content_hash = SafeCharField(verbose_name=_("content hash"), max_length=64, blank=True, default="", editable=False, db_index=True)
+    url = models.URLField(verbose_name=_("url"), max_length=512, blank=True, default="", editable=False, db_index=True)
+    etag = SafeCharField(verbose_name=_("ETag"), max_length=256, blank=True, default="", editable=False)
+    last_modified = SafeCharField(verbose_name=_("last modified"), max_length=64, blank=True, default="", editable=False)
 
     class Meta:
         verbose_name = _("sanction list")
@@ -91,6 +180,23 @@ class SanctionsListFile(SanctionListObject):
         return get_media_full_path(self.file.name)
 
 
+class ActiveSanctionsList(models.Model):
+    """Sanction list files currently in use per list type. Sources are switched in a single transaction
+    only after the import of the new files has completed, see services.activate_sanction_list_files().
+    """
+
+    list_type = SafeCharField(verbose_name=_("list type"), max_length=128, unique=True)
+    sources = models.ManyToManyField(SanctionsListFile, verbose_name=_("sources"), related_name="active_lists", blank=True)
+    activated = models.DateTimeField(verbose_name=_("activated"), default=now, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = _("active sanction list")
+        verbose_name_plural = _("active sanction lists")
+
+    def __str__(self):
+        return str(self.list_type)
+
+
 class Remark(models.Model):
     container = models.ForeignKey(SanctionListObject, on_delete=models.CASCADE)
     text = SafeTextField(verbose_name=_("text"), blank=True)
@@ -176,6 +282,7 @@ class NameAlias(SanctionListObject):
     class Meta:
         verbose_name = _("name alias")
         verbose_name_plural = _("name aliases")
+        # PostgreSQL trigram GIN indexes on lower(whole_name), lower(first_name) and lower(last_name) are created by migration 0018
 
     def __str__(self) -> str:
         return str(self.whole_name)
@@ -278,7 +385,72 @@ class Address(SanctionListObject):
             self.country_iso2_code = get_country_iso2_code(self.country_description)
 
 
+_name_search_supported: Dict[str, bool] = {}
+
+
+def is_name_search_supported(using: str = "default") -> bool:
+    """Returns True if the database supports trigram name search, i.e. PostgreSQL with pg_trgm extension installed (see migration 0018).
+    Result is cached per database alias."""
+    if using not in _name_search_supported:
+        connection = connections[using]
+        supported = False
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                supported = cursor.fetchone() is not None
+        _name_search_supported[using] = supported
+    return _name_search_supported[using]
+
+
+class SanctionEntityQuerySet(models.QuerySet):
+    def active(self):
+        """Returns entities of the active sanction list files (see ActiveSanctionsList) only."""
+        active_source_ids = ActiveSanctionsList.sources.through.objects.all().values("sanctionslistfile_id")  # type: ignore
+        return self.filter(source_id__in=active_source_ids)
+
+    def search_name(self, query: str, min_similarity: float = DEFAULT_NAME_SIMILARITY):
+        """Returns entities with name alias (whole, first or last name) similar to the query, most similar first.
+        Similarity (0-1) of the best matching alias is annotated as name_similarity.
+        On PostgreSQL aliases are matched with the pg_trgm % operator on lower case names, served by the trigram GIN indexes
+        of migration 0018. Matching entity ids are fetched immediately in a transaction which sets pg_trgm.similarity_threshold
+        to min_similarity with SET LOCAL, the setting is rolled back afterwards.
+        Without pg_trgm falls back to case-insensitive substring match.
+        """
+        name = normalize_name(query)
+        if not is_name_search_supported(self.db):
+            q = models.Q()
+            for k in NAME_SEARCH_FIELDS:
+                q |= models.Q(**{"namealias__{}__icontains".format(k): name})
+            return self.filter(q).distinct().annotate(name_similarity=models.Value(1.0, output_field=models.FloatField()))
+        q = models.Q()
+        for k in NAME_SEARCH_FIELDS:
+            q |= models.Q(TrigramSimilar(Lower(k), name))
+        aliases = NameAlias.objects.using(self.db).filter(q).order_by().values_list("sanction_id", flat=True).distinct()
+        with transaction.atomic(using=self.db):
+            with connections[self.db].cursor() as cursor:
+                cursor.execute("SET LOCAL pg_trgm.similarity_threshold = %s", [min_similarity])
+            ids = list(aliases)
+            # roll back (to savepoint) so that the threshold does not leak to an enclosing transaction
+            transaction.set_rollback(True, using=self.db)
+        similarity = Greatest(*[TrigramSimilarity(Lower(k), name) for k in NAME_SEARCH_FIELDS])
+        best = (
+            NameAlias.objects.using(self.db)
+            .filter(sanction_id=models.OuterRef("pk"))
+            .annotate(similarity=similarity)
+            .order_by("-similarity")
+            .values("similarity")[:1]
+        )
+        return self.filter(id__in=ids).annotate(name_similarity=models.Subquery(best, output_field=models.FloatField())).order_by("-name_similarity", "id")
+
+
+class SanctionEntityManager(models.Manager.from_queryset(SanctionEntityQuerySet)):  # type: ignore
+    def get_queryset(self):
+        """Raw source data is deferred, use SanctionEntity.get_data() or defer(None) to load it."""
+        return super().get_queryset().defer("data")
+
+
 class SanctionEntity(SanctionListObject):
+    objects = SanctionEntityManager()
     source = models.ForeignKey(SanctionsListFile, verbose_name=_("source"), on_delete=models.CASCADE)
     designation_details = SafeCharField(verbose_name=_("designation details"), **DEFAULT_DESCRIPTION_TYPE)  # type: ignore
     united_nation_id = SafeCharField(verbose_name=_("United Nation identifier"), **DEFAULT_DESCRIPTION_TYPE)  # type: ignore
@@ -286,6 +458,7 @@ class SanctionEntity(SanctionListObject):
     logical_id = models.BigIntegerField(verbose_name=_("logical id"), blank=True, null=True, default=None)
     subject_type = models.ForeignKey(SubjectType, verbose_name=_("subject type"), on_delete=models.PROTECT, null=True, default=None, blank=True)
     data = models.JSONField(_("data"), default=dict, blank=True, encoder=DjangoJSONEncoder)  # type: ignore
+    data_hash = SafeCharField(verbose_name=_("data hash"), max_length=64, blank=True, default="", editable=False)
 
     class Meta:
         verbose_name = _("sanction entity")
@@ -293,3 +466,21 @@ class SanctionEntity(SanctionListObject):
 
     def __str__(self):
         return "{}-{}".format(self.source.list_type, self.logical_id)
+
+    def get_data(self) -> dict:
+        """Returns raw source data of the entity from the storage it was imported to, see data_storage.py."""
+        if self.data:
+            return self.data
+        raw_data = SanctionEntityData.objects.filter(entity=self).first()
+        if raw_data is not None:
+            return decompress_data(raw_data.blob)
+        return read_data_archive(self.source.list_type, self.logical_id, self.data_hash) or {}
+
+
+class SanctionEntityData(models.Model):
+    entity = models.OneToOneField(SanctionEntity, verbose_name=_("sanction entity"), on_delete=models.CASCADE, primary_key=True, related_name="raw_data")
+    blob = models.BinaryField(_("compressed data"))
+
+    class Meta:
+        verbose_name = _("sanction entity data")
+        verbose_name_plural = _("sanction entity data")
@@ -2,15 +2,27 @@ import logging
 import re
 from datetime import date
 from time import strptime
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, Tuple, Optional, Iterator, List
 from django.core.exceptions import ValidationError
-from django.db import transaction
 from django.utils import translation
+from django.db.models import Model
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from jutil.admin import admin_log
 from jutil.format import choices_label
 from jutil.xml import xml_to_dict
+from jsanctions.bulk import (
+    BulkWriter,
+    LookupCache,
+    DEFAULT_IMPORT_BATCH_SIZE,
+    BULK_LOADER,
+    create_bulk_writer,
+    save_object,
+    persist_objects,
+    save_sanction_entity_data,
+)
+from jsanctions.helpers import open_compressed_file, get_data_hash, iterparse_xml_elements
+from jsanctions.services import SanctionListImport, import_sanction_list_file
 from jsanctions.models import (
     SanctionsListFile,
     SanctionEntity,
@@ -30,11 +42,20 @@ OFAC_XML_ARRAY_TAGS = ["sdnEntry", "program", "aka", "dateOfBirthItem", "placeOf
 
 
 def load_ofac_sanction_list_as_dict(filename: str) -> Dict[str, Any]:
-    with open(filename, "rb") as fp:
+    with open_compressed_file(filename) as fp:
         data: Dict[str, Any] = xml_to_dict(fp.read(), array_tags=OFAC_XML_ARRAY_TAGS)
     return data
 
 
+def iter_ofac_sanction_list(filename: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Parses OFAC sanction list incrementally. Yields ("publshInformation", data) first
+    and then each sdnEntry as ("sdnEntry", data) pair as soon as the entry has been parsed.
+    """
+    for tag, data in iterparse_xml_elements(filename, ["publshInformation", "sdnEntry"], array_tags=OFAC_XML_ARRAY_TAGS):
+        if tag in ("publshInformation", "sdnEntry"):
+            yield tag, data or {}
+
+
 def parse_ofac_date(v: str) -> date:
     st = strptime(v, "%m/%d/%Y")
     if not st:
@@ -42,6 +63,14 @@ def parse_ofac_date(v: str) -> date:
     return date(st.tm_year, st.tm_mon, st.tm_mday)
 
 
+def read_ofac_generation_date(filename: str) -> Optional[date]:
+    """Returns OFAC sanction list publish date by parsing only the beginning of the file."""
+    for tag, data in iter_ofac_sanction_list(filename):
+        if tag == "publshInformation":
+            return parse_ofac_date(data["Publish_Date"])
+    return None
+
+
 def parse_ofac_dob(v: str) -> Tuple[Optional[int], Optional[int], Optional[int]]:
     if re.fullmatch(r"\d{4}", v):
         return int(v), None, None
@@ -59,19 +88,21 @@ def get_opt_ofac_str(data: Dict[str, Any], key: str) -> str:
     return data.get(key, "") or ""
 
 
-def get_ofac_subject_type(data: Dict[str, Any]) -> SubjectType:
+def get_ofac_subject_type(data: Dict[str, Any], lookups: Optional[LookupCache] = None) -> SubjectType:
+    if lookups is None:
+        lookups = LookupCache()
     sdn_type = data["sdnType"]
     if sdn_type == "Entity":
-        obj, created = SubjectType.objects.get_or_create(classification_code=SubjectType.ENTERPRISE)
+        obj, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.ENTERPRISE)
     elif sdn_type == "Individual":
-        obj, created = SubjectType.objects.get_or_create(classification_code=SubjectType.PERSON)
+        obj, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.PERSON)
     elif sdn_type == "Vessel":
-        obj, created = SubjectType.objects.get_or_create(classification_code=SubjectType.VESSEL)
+        obj, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.VESSEL)
     elif sdn_type == "Aircraft":
-        obj, created = SubjectType.objects.get_or_create(classification_code=SubjectType.AIRCRAFT)
+        obj, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.AIRCRAFT)
     else:
         logger.warning("Unknown sdnType: %s", sdn_type)
-        obj, created = SubjectType.objects.get_or_create(classification_code=sdn_type, code=sdn_type)
+        obj, created = lookups.get_or_create(SubjectType, classification_code=sdn_type, code=sdn_type)
     assert isinstance(obj, SubjectType)
     if created:
         obj.code = choices_label(SubjectType.CLASSIFICATION_CODES, obj.classification_code)
@@ -86,18 +117,21 @@ def parse_ofac_uid(data: Dict[str, Any]) -> int:
     return int(uid)
 
 
-def create_ofac_alias(se: SanctionEntity, **kwargs) -> NameAlias:
+def build_ofac_alias(se: SanctionEntity, **kwargs) -> NameAlias:
     first_name = kwargs.get("firstName") or ""
     last_name = kwargs.get("lastName") or ""
     uid = parse_ofac_uid(kwargs)
     whole_name = (first_name + " " + last_name).strip()
-    alias = NameAlias(sanction=se, first_name=first_name, last_name=last_name, whole_name=whole_name, logical_id=uid)
-    alias.full_clean()
-    alias.save()
+    return NameAlias(sanction=se, first_name=first_name, last_name=last_name, whole_name=whole_name, logical_id=uid)
+
+
+def create_ofac_alias(se: SanctionEntity, **kwargs) -> NameAlias:
+    alias = build_ofac_alias(se, **kwargs)
+    save_object(alias)
     return alias
 
 
-def create_ofac_dob(se: SanctionEntity, **kwargs) -> BirthDate:
+def build_ofac_dob(se: SanctionEntity, **kwargs) -> BirthDate:
     dob = BirthDate(sanction=se)
     dob.logical_id = parse_ofac_uid(kwargs)
     dob.birth_date_description = kwargs.get("dateOfBirth") or ""
@@ -107,22 +141,28 @@ def create_ofac_dob(se: SanctionEntity, **kwargs) -> BirthDate:
     dob.day_of_month = day_of_month  # type: ignore
     if year and month_of_year and day_of_month:
         dob.birth_date = date(year, month_of_year, day_of_month)
-    dob.full_clean()
-    dob.save()
     return dob
 
 
-def create_ofac_place_of_birth(se: SanctionEntity, **kwargs) -> BirthDate:
-    dob = BirthDate.objects.all().filter(sanction=se, place="").order_by("id").first()
+def create_ofac_dob(se: SanctionEntity, **kwargs) -> BirthDate:
+    dob = build_ofac_dob(se, **kwargs)
+    save_object(dob)
+    return dob
+
+
+def build_ofac_place_of_birth(se: SanctionEntity, dobs: List[BirthDate], **kwargs) -> BirthDate:
+    """Sets place of birth to the first birth date without place.
+    If there is no such birth date then new BirthDate is created and appended to dobs.
+    """
+    dob = next((e for e in dobs if not e.place), None)
     if dob is None:
         dob = BirthDate(sanction=se, logical_id=parse_ofac_uid(kwargs))
+        dobs.append(dob)
     dob.place = get_opt_ofac_str(kwargs, "placeOfBirth")
-    dob.full_clean()
-    dob.save()
     return dob
 
 
-def create_ofac_address(se: SanctionEntity, **kwargs) -> Address:
+def build_ofac_address(se: SanctionEntity, **kwargs) -> Address:
     address = Address(sanction=se)
     address.logical_id = parse_ofac_uid(kwargs)
     address.region = get_opt_ofac_str(kwargs, "stateOrProvince")
@@ -137,95 +177,158 @@ def create_ofac_address(se: SanctionEntity, **kwargs) -> Address:
         else:
             break
     address.street = street.strip()
-    address.full_clean()
-    address.save()
     return address
 
 
-def create_ofac_id(se: SanctionEntity, **kwargs) -> Identification:
+def create_ofac_address(se: SanctionEntity, **kwargs) -> Address:
+    address = build_ofac_address(se, **kwargs)
+    save_object(address)
+    return address
+
+
+def build_ofac_id(se: SanctionEntity, **kwargs) -> Identification:
     id_obj = Identification(sanction=se)
     id_obj.logical_id = parse_ofac_uid(kwargs)
     id_obj.number = kwargs.get("idNumber") or ""
     id_obj.identification_type_description = kwargs.get("idType") or ""
     id_obj.country_description = kwargs.get("idCountry") or ""
-    id_obj.full_clean()
-    id_obj.save()
     return id_obj
 
 
-def set_ofac_members(  # noqa
-    se: SanctionEntity,
-    data: Dict[str, Any],
-    verbose: bool = False,
-    padding: int = 0,
-):
+def create_ofac_id(se: SanctionEntity, **kwargs) -> Identification:
+    id_obj = build_ofac_id(se, **kwargs)
+    save_object(id_obj)
+    return id_obj
+
+
+def build_ofac_entity(se: SanctionEntity, data: Dict[str, Any], lookups: Optional[LookupCache] = None) -> List[Model]:  # noqa
+    """Sets sanction entity attributes and assembles child objects from parsed OFAC sdnEntry data in memory.
+    Place of birth items are merged to the birth dates so that each BirthDate is written once with both fields.
+    Returns unsaved objects in save order, the sanction entity first (see persist_objects).
+    """
+    objs: List[Model] = [se]
+
     # uid
     se.logical_id = parse_ofac_uid(data)
 
     # firstName, lastName
     first_name, last_name = get_opt_ofac_str(data, "firstName"), get_opt_ofac_str(data, "lastName")
     if first_name or last_name:
-        create_ofac_alias(se, **data)
+        objs.append(build_ofac_alias(se, **data))
 
     # sdnType
-    se.subject_type = get_ofac_subject_type(data)
+    se.subject_type = get_ofac_subject_type(data, lookups)
 
     # remarks
     remarks = data.get("remarks") or ""
     if remarks:
-        remark_obj = Remark(container=se, text=remarks)
-        remark_obj.full_clean()
-        remark_obj.save()
+        objs.append(Remark(container=se, text=remarks))
 
     # programList
     for program in data.get("programList", {}).get("program", []) or []:
         if program:
-            remark_obj = Remark(container=se, text="program={}".format(program))
-            remark_obj.full_clean()
-            remark_obj.save()
+            objs.append(Remark(container=se, text="program={}".format(program)))
 
     # akaList
     for e_data in data.get("akaList", {}).get("aka", []) or []:
-        create_ofac_alias(se, **e_data)
+        objs.append(build_ofac_alias(se, **e_data))
 
-    # dateOfBirthList
+    # dateOfBirthList, placeOfBirthList
+    dobs: List[BirthDate] = []
     for e_data in data.get("dateOfBirthList", {}).get("dateOfBirthItem", []) or []:
-        create_ofac_dob(se, **e_data)
-
-    # placeOfBirthList
+        dobs.append(build_ofac_dob(se, **e_data))
     for e_data in data.get("placeOfBirthList", {}).get("placeOfBirthItem", []) or []:
-        create_ofac_place_of_birth(se, **e_data)
+        build_ofac_place_of_birth(se, dobs, **e_data)
+    objs.extend(dobs)
 
     # addressList
     for e_data in data.get("addressList", {}).get("address", []) or []:
-        create_ofac_address(se, **e_data)
+        objs.append(build_ofac_address(se, **e_data))
 
     # idList
     for e_data in data.get("idList", {}).get("id", []) or []:
-        create_ofac_id(se, **e_data)
+        objs.append(build_ofac_id(se, **e_data))
+    return objs
 
-    se.full_clean()
-    se.save()
-    if verbose:
-        logger.info("%sSaved %s", padding * " ", se)
 
+def set_ofac_members(
+    se: SanctionEntity,
+    data: Dict[str, Any],
+    verbose: bool = False,
+    padding: int = 0,
+    writer: Optional[BulkWriter] = None,
+    lookups: Optional[LookupCache] = None,
+):
+    """Sets sanction entity attributes and creates child objects from parsed OFAC sdnEntry data.
+    If writer is specified objects are added to the writer and validated in batches instead of
+    calling full_clean() and save() for each object.
+    """
+    persist_objects(build_ofac_entity(se, data, lookups), writer)
+    if verbose:
+        logger.info("%s%s %s", padding * " ", "Saved" if writer is None else "Prepared", se)
 
-def import_ofac_sanctions(source: SanctionsListFile, verbose: bool = False):
-    data = load_ofac_sanction_list_as_dict(source.full_path)
-    source.generation_date = parse_ofac_date(data["publshInformation"]["Publish_Date"])
 
-    t0 = now()
-    entities_list = data.get("sdnEntry", [])
-    for se_data in entities_list:
+def import_ofac_sanction_entities(
+    source: SanctionsListFile,
+    items: List[Tuple[Dict[str, Any], str]],
+    verbose: bool = False,
+    loader: str = BULK_LOADER,
+    lookups: Optional[LookupCache] = None,
+):
+    """Imports a batch of parsed sdnEntry (data, data hash) pairs in a single transaction."""
+    writer = create_bulk_writer(loader, validate=True)
+    for se_data, data_hash in items:
+        se = SanctionEntity(source=source, data_hash=data_hash)
+        set_ofac_members(se, se_data, verbose=verbose, padding=4, writer=writer, lookups=lookups)
+        save_sanction_entity_data(se, se_data, writer)
+    writer.flush()
+
+
+def iter_ofac_sanction_records(
+    source: SanctionsListFile, verbose: bool = False, lookups: Optional[LookupCache] = None
+) -> Iterator[Tuple[Optional[int], str, Tuple[Dict[str, Any], str]]]:
+    """Yields (logical id, data hash, (data, data hash)) of sdnEntry elements, see import_sanction_list_file().
+    Generation date is set to the source. If lookups is given subject types are resolved while parsing."""
+    for tag, se_data in iter_ofac_sanction_list(source.full_path):
+        if tag == "publshInformation":
+            source.generation_date = parse_ofac_date(se_data["Publish_Date"])
+            continue
         assert isinstance(se_data, dict)
         if verbose:
             logger.info("  sdnEntry uid %s", se_data.get("uid"))
-        with transaction.atomic():
-            se = SanctionEntity.objects.create(source=source, data=se_data)
-            set_ofac_members(se, se_data, verbose=verbose, padding=4)
+        if lookups is not None:
+            get_ofac_subject_type(se_data, lookups)
+        data_hash = get_data_hash(se_data)
+        yield parse_ofac_uid(se_data), data_hash, (se_data, data_hash)
+
 
-    source.imported = now()
-    source.save()
-    msg = "Imported {} sanction entities from {} in {}".format(len(entities_list), source.full_path, source.imported - t0)
+def import_ofac_sanctions(
+    source: SanctionsListFile,
+    verbose: bool = False,
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+    loader: str = BULK_LOADER,
+    incremental: bool = False,
+    workers: int = 0,
+    bisect: bool = False,
+    activate: bool = False,
+    complete: bool = True,
+) -> SanctionListImport:
+    """Imports OFAC sanction list file, see import_sanction_list_file() for the options."""
+    t0 = now()
+    lookups = LookupCache()
+    imp = import_sanction_list_file(
+        source,
+        iter_ofac_sanction_records(source, verbose, lookups if workers > 1 else None),
+        import_ofac_sanction_entities,
+        (verbose, loader, lookups),
+        batch_size=batch_size,
+        incremental=incremental,
+        workers=workers,
+        bisect=bisect,
+        activate=activate,
+        complete=complete,
+    )
+    msg = "Imported {} sanction entities from {} in {}".format(imp.count, source.full_path, now() - t0)
     logger.info(msg)
     admin_log([source], msg)
+    return imp
@@ -0,0 +1,85 @@
+import logging
+import multiprocessing
+from collections import deque
+from typing import Callable, Deque, Any, Sequence
+import django
+from django.apps import apps
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def init_import_worker():
+    if not apps.ready:
+        django.setup()
+
+
+def run_import_batch(func: Callable[..., Any], bisect: bool, source: Any, items: Sequence[Any], *args) -> int:
+    """Calls func(source, items, *args). If bisect is True and the batch fails, the batch is split in halves
+    recursively until the failing records are isolated. Failing single records are logged and skipped.
+    Returns number of skipped records.
+    """
+    try:
+        func(source, items, *args)
+        return 0
+    except Exception as exc:
+        if not bisect:
+            raise
+        if len(items) == 1:
+            logger.error("Import of record failed, skipped: %s: %s", str(items[0])[:256], exc)
+            return 1
+        logger.warning("Import of batch of %s records failed, splitting: %s", len(items), exc)
+        n = len(items) // 2
+        return run_import_batch(func, bisect, source, items[:n], *args) + run_import_batch(func, bisect, source, items[n:], *args)
+
+
+class ImportBatchRunner:
+    """Runs import batch function either in the calling process (workers <= 1) or in a pool of worker processes.
+    Each worker process opens its own database connection. Number of batches in flight is bounded
+    so that parsing does not run arbitrarily far ahead of the workers.
+    Lookup rows shared between batches (e.g. SubjectType) need to be created by the caller before
+    submitting batches so that workers never race on get_or_create.
+    Batch function is called as func(source, items, *args), see run_import_batch() for bisect.
+    """
+
+    def __init__(self, func: Callable[..., Any], workers: int = 0, bisect: bool = False, using: str = "default"):
+        self.func = func
+        self.workers = workers
+        self.bisect = bisect
+        self.skipped = 0
+        self.pool = None
+        self.pending: Deque[Any] = deque()
+        if workers > 1:
+            if connections[using].in_atomic_block:
+                raise Exception("Parallel import cannot be run inside a transaction")
+            # forked workers must not inherit open database connections
+            connections.close_all()
+            start_methods = multiprocessing.get_all_start_methods()
+            mp_context = multiprocessing.get_context("fork" if "fork" in start_methods else "spawn")
+            self.pool = mp_context.Pool(workers, initializer=init_import_worker)
+            logger.info("Import worker pool of %s processes started", workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if self.pool is not None:
+            if exc_type is not None:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def submit(self, source: Any, items: Sequence[Any], *args):
+        if self.pool is None:
+            self.skipped += run_import_batch(self.func, self.bisect, source, items, *args)
+            return
+        while len(self.pending) >= 2 * self.workers:
+            self.skipped += self.pending.popleft().get()
+        self.pending.append(self.pool.apply_async(run_import_batch, (self.func, self.bisect, source, items) + args))
+
+    def join(self):
+        """Waits until all submitted batches have been imported. Raises the first worker error if any."""
+        while self.pending:
+            self.skipped += self.pending.popleft().get()
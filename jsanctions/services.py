@@ -1,19 +1,346 @@
 import logging
 import os
-from typing import List
-from jsanctions.models import SanctionsListFile, SanctionEntity
+import threading
+from datetime import date, datetime
+from typing import List, Dict, Tuple, Optional, Callable, Set, Iterable, Sequence, Any, Type
+from django.db import models, transaction, connections
+from django.utils.timezone import now
+from jsanctions.models import (
+    SanctionsListFile,
+    SanctionEntity,
+    ActiveSanctionsList,
+    SanctionListObject,
+    Remark,
+    Regulation,
+    NameAlias,
+    Identification,
+    BirthDate,
+    Citizenship,
+    Address,
+    SanctionEntityData,
+)
+from jsanctions.bulk import DEFAULT_IMPORT_BATCH_SIZE
+from jsanctions.parallel import ImportBatchRunner
+from jsanctions.data_storage import get_data_storage, delete_data_archive, DATA_STORAGE_ARCHIVE
 
 logger = logging.getLogger(__name__)
 
 
-def delete_old_sanction_list_files(list_type: str, exclude: List[SanctionsListFile]):
-    exclude_ids = [ex.id for ex in exclude]
-    qs = SanctionsListFile.objects.all().filter(list_type=list_type).exclude(id__in=exclude_ids)
-    for e in qs:
+class IncrementalImportMatcher:
+    """Matches imported records against previously imported entities of the same list type by logical id and data hash.
+    If the source has a download URL, only entities of files from the same URL are matched since list types
+    can consist of several files (e.g. OFAC sdn.xml and consolidated.xml). Unchanged entities are moved to the new source instead of importing them again. Changed and removed
+    entities stay with the old source files and get retired when the old files are deleted.
+    """
+
+    def __init__(self, source: SanctionsListFile):
+        self.source = source
+        self.previous: Dict[int, Tuple[int, str]] = {}
+        self.unchanged_ids: List[int] = []
+        self.unchanged_count = 0
+        qs = (
+            SanctionEntity.objects.all()
+            .filter(source__list_type=source.list_type, source__imported__isnull=False, logical_id__isnull=False)
+            .exclude(source=source)
+            .order_by("source__imported", "id")
+        )
+        if source.url:
+            qs = qs.filter(source__url=source.url)
+        for pk, logical_id, data_hash in qs.values_list("id", "logical_id", "data_hash").iterator():
+            self.previous[logical_id] = (pk, data_hash)
+
+    def match(self, logical_id: Optional[int], data_hash: str) -> bool:
+        """Returns True if entity is unchanged since the previous import."""
+        prev = self.previous.pop(logical_id, None) if logical_id is not None else None
+        if prev is None or not prev[1] or prev[1] != data_hash:
+            return False
+        self.unchanged_ids.append(prev[0])
+        self.unchanged_count += 1
+        return True
+
+    @property
+    def removed_count(self) -> int:
+        return len(self.previous)
+
+    def flush(self, chunk_size: int = 1000):
+        """Moves matched unchanged entities to the new source."""
+        for i in range(0, len(self.unchanged_ids), chunk_size):
+            SanctionEntity.objects.all().filter(id__in=self.unchanged_ids[i : i + chunk_size]).update(source=self.source)
+        self.unchanged_ids = []
+
+
+DEFAULT_PURGE_CHUNK_SIZE = 500
+DELETE_ROWS_BATCH_SIZE = 500  # max number of query parameters per DELETE statement
+SANCTION_ENTITY_CHILD_MODELS = [Regulation, NameAlias, Identification, BirthDate, Citizenship, Address]
+
+
+def delete_rows(model: Type[models.Model], field_name: str, values: Sequence[Any], using: str = "default"):
+    """Deletes rows of the model table with plain DELETE statements by field value,
+    without collecting related objects or sending signals. Does not delete parent rows of multi-table inheritance.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    field = model._meta.pk if field_name == "pk" else model._meta.get_field(field_name)  # type: ignore
+    sql = "DELETE FROM {} WHERE {} IN ({{}})".format(qn(model._meta.db_table), qn(field.column))  # type: ignore
+    with connection.cursor() as cursor:
+        for i in range(0, len(values), DELETE_ROWS_BATCH_SIZE):
+            batch = values[i : i + DELETE_ROWS_BATCH_SIZE]
+            cursor.execute(sql.format(", ".join(["%s"] * len(batch))), batch)
+
+
+def purge_sanction_entities(ids: List[int], using: str = "default"):
+    """Deletes sanction entities and all rows owned by them with set-based DELETE statements,
+    without collecting cascaded objects in Python. Ids of the owned child objects are collected first,
+    then rows are deleted child tables first: remarks, child objects, raw data and entities,
+    and last the SanctionListObject parent rows of the entities and their child objects.
+    """
+    with transaction.atomic(using=using):
+        child_ids: Dict[Type[models.Model], List[int]] = {}
+        for model in SANCTION_ENTITY_CHILD_MODELS:
+            child_ids[model] = list(model.objects.using(using).filter(sanction_id__in=ids).values_list("pk", flat=True))
+        object_ids = [pk for pks in child_ids.values() for pk in pks] + list(ids)
+        delete_rows(Remark, "container", object_ids, using)
+        for model, pks in child_ids.items():
+            delete_rows(model, "pk", pks, using)
+        delete_rows(SanctionEntityData, "entity", ids, using)
+        delete_rows(SanctionEntity, "pk", ids, using)
+        delete_rows(SanctionListObject, "pk", object_ids, using)
+
+
+def delete_unused_data_archives(list_type: str, keys: Set[Tuple[Optional[int], str]], using: str = "default"):
+    """Deletes raw data archive files of (logical_id, data_hash) keys not used by remaining entities of the list type."""
+    logical_ids = {logical_id for logical_id, data_hash in keys}
+    qs = SanctionEntity.objects.using(using).filter(source__list_type=list_type, logical_id__in=logical_ids)
+    used = set(qs.values_list("logical_id", "data_hash"))
+    for logical_id, data_hash in keys - used:
+        delete_data_archive(list_type, logical_id, data_hash)
+
+
+def purge_sanction_list_file_entities(
+    e: SanctionsListFile, chunk_size: int = DEFAULT_PURGE_CHUNK_SIZE, progress: Optional[Callable[[int, int], None]] = None, using: str = "default"
+) -> int:
+    """Deletes sanction entities of the file in chunks of chunk_size entities, one transaction per chunk.
+    Optional progress callback is called as progress(deleted, total) after each chunk.
+    Returns number of deleted entities.
+    """
+    qs = SanctionEntity.objects.using(using).filter(source=e)
+    total = qs.count()
+    deleted = 0
+    while True:
+        ids = list(qs.order_by("id").values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        archived = set(qs.filter(id__in=ids).values_list("logical_id", "data_hash")) if get_data_storage() == DATA_STORAGE_ARCHIVE else set()
+        purge_sanction_entities(ids, using)
+        if archived:
+            delete_unused_data_archives(e.list_type, archived, using)
+        deleted += len(ids)
+        logger.info("SanctionsListFile id=%s: %s/%s sanction entities deleted", e.id, deleted, total)
+        if progress is not None:
+            progress(deleted, total)
+    return deleted
+
+
+def delete_sanction_list_file(
+    e: SanctionsListFile,
+    exclude: Optional[List[SanctionsListFile]] = None,
+    chunk_size: int = DEFAULT_PURGE_CHUNK_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    keep_file: bool = False,
+):
+    """Deletes sanction list file, its entities and the stored file unless keep_file is True or the file is used by an excluded list file."""
+    exclude = exclude or []
+    logger.info("Deleting SanctionsListFile id=%s", e.id)
+    if not keep_file and os.path.isfile(e.full_path) and not any(ex.full_path == e.full_path for ex in exclude):
+        os.unlink(e.full_path)
+        logger.info("%s deleted", e.full_path)
+    purge_sanction_list_file_entities(e, chunk_size, progress)
+    e.delete()
+
+
+def get_old_sanction_list_files(list_type: str, exclude: List[SanctionsListFile], keep_created_after: Optional[datetime] = None):
+    """Returns files of the list type deleted by delete_old_sanction_list_files()."""
+    qs = SanctionsListFile.objects.all().filter(list_type=list_type).exclude(id__in=[ex.id for ex in exclude])
+    if keep_created_after is not None:
+        qs = qs.exclude(imported__isnull=True, created__gt=keep_created_after)
+    return qs
+
+
+def delete_old_sanction_list_files(
+    list_type: str,
+    exclude: List[SanctionsListFile],
+    chunk_size: int = DEFAULT_PURGE_CHUNK_SIZE,
+    progress: Optional[Callable[[int, int], None]] = None,
+    background: bool = False,
+    keep_created_after: Optional[datetime] = None,
+) -> Optional[threading.Thread]:
+    """Deletes files of the list type except the excluded ones. Entities are purged in chunks, see purge_sanction_list_file_entities().
+    If background is True, deletion runs in a separate thread which is returned. Excluded files should be
+    activated before (see activate_sanction_list_files()) so that queries of active entities are not affected.
+    If keep_created_after is set, files not imported yet and created after it are kept since their import may be in progress.
+    """
+    if background:
+        thread = threading.Thread(
+            target=_delete_old_sanction_list_files_thread,
+            args=(list_type, exclude, chunk_size, progress, keep_created_after),
+            name="delete-old-" + list_type,
+        )
+        thread.start()
+        return thread
+    for e in get_old_sanction_list_files(list_type, exclude, keep_created_after):
         assert isinstance(e, SanctionsListFile)
-        logger.info("Deleting SanctionsListFile id=%s", e.id)
-        if os.path.isfile(e.full_path) and not any(ex.full_path == e.full_path for ex in exclude):
-            os.unlink(e.full_path)
-            logger.info("%s deleted", e.full_path)
-        SanctionEntity.objects.all().filter(source=e).delete()
-        e.delete()
+        delete_sanction_list_file(e, exclude, chunk_size, progress)
+    return None
+
+
+def _delete_old_sanction_list_files_thread(
+    list_type: str,
+    exclude: List[SanctionsListFile],
+    chunk_size: int,
+    progress: Optional[Callable[[int, int], None]],
+    keep_created_after: Optional[datetime],
+):
+    try:
+        delete_old_sanction_list_files(list_type, exclude, chunk_size, progress, keep_created_after=keep_created_after)
+    except Exception as exc:
+        logger.exception("Deleting old %s files failed: %s", list_type, exc)
+    finally:
+        connections.close_all()
+
+
+def find_imported_sanction_list_file(
+    list_type: str,
+    content_hash: str = "",
+    generation_date: Optional[date] = None,
+    exclude: Optional[List[SanctionsListFile]] = None,
+    url: str = "",
+) -> Optional[SanctionsListFile]:
+    """Returns the newest already imported sanction list file of the list type if it has
+    the same content hash or (if specified) the same generation date and download URL.
+    Older files are not matched since incremental imports move unchanged entities off them.
+    URL scopes the comparison since list types can consist of several files (e.g. OFAC sdn.xml and consolidated.xml).
+    """
+    if not content_hash and generation_date is None:
+        return None
+    exclude_ids = [ex.id for ex in exclude or []]
+    qs = SanctionsListFile.objects.all().filter(list_type=list_type, imported__isnull=False).exclude(id__in=exclude_ids)
+    if url:
+        qs = qs.filter(url=url)
+    latest = qs.order_by("-imported").first()
+    if latest is None:
+        return None
+    assert isinstance(latest, SanctionsListFile)
+    if content_hash and latest.content_hash == content_hash:
+        return latest
+    if generation_date is not None and latest.generation_date == generation_date and latest.url == url:
+        return latest
+    return None
+
+
+def discard_already_imported_sanction_list_file(
+    source: SanctionsListFile, generation_date: Optional[date] = None, keep_file: bool = False
+) -> Optional[SanctionsListFile]:
+    """Checks if identical content (or optionally the same generation date) has already been imported
+    for the list type. If so, the new sanction list file is deleted and the already imported file is returned.
+    Download URL and ETag / Last-Modified validators of the new file are copied to the already imported file.
+    Set keep_file for files supplied by the user and used as is, those are never deleted from disk.
+    """
+    previous = find_imported_sanction_list_file(source.list_type, source.content_hash, generation_date, exclude=[source], url=source.url)
+    if previous is not None:
+        logger.info("%s is unchanged since %s (id=%s), import skipped", source, previous, previous.id)
+        if source.url:
+            # keep conditional request validators of the latest download, see get_conditional_headers()
+            previous.url, previous.etag, previous.last_modified = source.url, source.etag, source.last_modified
+            previous.save(update_fields=["url", "etag", "last_modified"])
+        delete_sanction_list_file(source, exclude=[previous], keep_file=keep_file)
+    return previous
+
+
+def activate_sanction_list_files(list_type: str, sources: List[SanctionsListFile]) -> ActiveSanctionsList:
+    """Switches active sanction list files of the list type in a single transaction.
+    Call only after the import of the sources has completed.
+    """
+    with transaction.atomic():
+        active = ActiveSanctionsList.objects.select_for_update().get_or_create(list_type=list_type)[0]
+        assert isinstance(active, ActiveSanctionsList)
+        active.sources.set(sources)
+        active.activated = now()
+        active.save(update_fields=["activated"])
+    logger.info("%s active sanction list files: %s", list_type, ", ".join(str(e) for e in sources))
+    return active
+
+
+class SanctionListImport:
+    """Imported sanction list file waiting for completion, see import_sanction_list_file() and complete_sanction_list_imports()."""
+
+    def __init__(self, source: SanctionsListFile, matcher: Optional[IncrementalImportMatcher], count: int, skipped: int):
+        self.source = source
+        self.matcher = matcher
+        self.count = count
+        self.skipped = skipped
+
+
+def complete_sanction_list_imports(imports: List[SanctionListImport], activate: Optional[List[SanctionsListFile]] = None):
+    """Completes imports in a single transaction: moves unchanged entities of incremental imports to the new sources,
+    marks the sources imported and, if activate is given, makes those files the active files of the list type.
+    Entities of the active files are therefore never missing in between.
+    """
+    with transaction.atomic():
+        for imp in imports:
+            if imp.matcher is not None:
+                imp.matcher.flush()
+                logger.info("%s unchanged sanction entities kept, %s removed", imp.matcher.unchanged_count, imp.matcher.removed_count)
+            imp.source.imported = now()
+            imp.source.save()
+        if activate is not None:
+            activate_sanction_list_files(imports[0].source.list_type, activate)
+
+
+def import_sanction_list_file(
+    source: SanctionsListFile,
+    records: Iterable[Tuple[Optional[int], str, Any]],
+    import_batch: Callable[..., Any],
+    batch_args: Sequence[Any] = (),
+    prepare_batch: Optional[Callable[[List[Any]], None]] = None,
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+    incremental: bool = False,
+    workers: int = 0,
+    bisect: bool = False,
+    activate: bool = False,
+    complete: bool = True,
+) -> SanctionListImport:
+    """Imports sanction list file records in batches. records yields parsed (logical id, data hash, batch item) tuples of the file,
+    batches are imported by import_batch(source, items, *batch_args) and prepare_batch(items) is called before each batch is submitted.
+    If workers > 1 batches of batch_size records are imported in parallel worker processes.
+    If bisect is True failing batches are split to isolate and skip invalid records, see run_import_batch().
+    If incremental is True unchanged records are not imported but the previously imported entities are kept, see IncrementalImportMatcher.
+    If complete is False the caller needs to call complete_sanction_list_imports(), otherwise the import is completed
+    and if activate is True the source is made the active file of the list type.
+    """
+    count = 0
+    items: List[Any] = []
+    matcher = IncrementalImportMatcher(source) if incremental else None
+
+    def submit():
+        if prepare_batch is not None:
+            prepare_batch(items)
+        runner.submit(source, items, *batch_args)
+
+    with ImportBatchRunner(import_batch, workers, bisect) as runner:
+        for logical_id, data_hash, item in records:
+            count += 1
+            if matcher is not None and matcher.match(logical_id, data_hash):
+                continue
+            items.append(item)
+            if len(items) >= batch_size:
+                submit()
+                items = []
+        if items:
+            submit()
+        runner.join()
+    if runner.skipped:
+        logger.error("%s invalid sanction entities skipped", runner.skipped)
+    imp = SanctionListImport(source, matcher, count, runner.skipped)
+    if complete:
+        complete_sanction_list_imports([imp], [source] if activate else None)
+    return imp
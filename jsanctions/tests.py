@@ -1,10 +1,124 @@
+import importlib.util
 import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from importlib import import_module
+from unittest import mock, skipUnless
+from urllib.parse import urlsplit
+import requests
 from django.conf import settings
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils.timezone import now
+from jutil.format import get_media_full_path
+from jutil.xml import xml_to_dict
+from jsanctions.admin import SanctionEntityAdmin
+from jsanctions.bulk import BULK_LOADER, COPY_LOADER
+from jsanctions.data_storage import DATA_STORAGE_COMPRESSED
+from jsanctions.download import DownloadManager, DownloadRequest
 from jsanctions.eu import import_eu_sanctions
-from jsanctions.models import SanctionEntity, SanctionsListFile
+from jsanctions.helpers import iterparse_xml_elements, get_country_iso2_code, get_file_hash, COMPRESSION_EXTENSIONS, ZSTD_COMPRESSION
+from jsanctions.models import (
+    SanctionEntity,
+    SanctionsListFile,
+    SanctionEntityData,
+    SanctionListObject,
+    NameAlias,
+    Address,
+    BirthDate,
+    Remark,
+    Identification,
+    Citizenship,
+    Regulation,
+    is_name_search_supported,
+)
 from jsanctions.ofac import import_ofac_sanctions
-from jsanctions.un import import_un_sanctions
+from jsanctions.parallel import run_import_batch
+from jsanctions.services import (
+    activate_sanction_list_files,
+    delete_old_sanction_list_files,
+    complete_sanction_list_imports,
+    discard_already_imported_sanction_list_file,
+    find_imported_sanction_list_file,
+)
+from jsanctions.un import import_un_sanctions, UN_XML_ARRAY_TAGS, UN_LIST_TYPE
+
+
+def get_imported_rows(source: SanctionsListFile) -> dict:
+    """Returns imported rows of the source file by model without database ids so that imports can be compared."""
+    keys = {}
+    rows = {}
+    for model in [SanctionEntity, NameAlias, Address, Identification, BirthDate, Citizenship, Regulation]:
+        qs = model.objects.filter(source=source) if model is SanctionEntity else model.objects.filter(sanction__source=source)
+        if model is SanctionEntity:
+            qs = qs.defer(None)
+        rows[model.__name__] = []
+        for obj in qs.order_by("id"):
+            row = [model.__name__]
+            for f in model._meta.local_concrete_fields:
+                if f.primary_key or f.name == "source":
+                    continue
+                row.append(keys[getattr(obj, f.attname)] if f.name == "sanction" else getattr(obj, f.attname))
+            if model is SanctionEntity:
+                row.append(obj.get_data())
+            keys[obj.pk] = tuple(str(v) for v in row)
+            rows[model.__name__].append(keys[obj.pk])
+    rows["Remark"] = [(keys[r.container_id], r.text) for r in Remark.objects.filter(container_id__in=keys).order_by("id")]
+    return {k: sorted(v) for k, v in rows.items()}
+
+
+class FakeResponse:
+    """requests.Response stand-in for streamed downloads. If error is set it is raised after the chunks have been read."""
+
+    def __init__(self, status_code: int = 200, chunks: Sequence[bytes] = (), headers: Optional[Dict[str, str]] = None, error: Optional[Exception] = None):
+        self.status_code = status_code
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("{} Error".format(self.status_code))
+
+    def iter_content(self, chunk_size: int = 1):
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+
+
+class SyncExecutor:
+    """ProcessPoolExecutor stand-in which runs the submitted calls in the calling process."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
 
 
 class Tests(TestCase):
@@ -24,6 +138,93 @@ class Tests(TestCase):
         print("OFAC count =", SanctionEntity.objects.all().filter(source=source).count())
         self.assertEqual(SanctionEntity.objects.all().filter(source=source).count(), 8832)
 
+    def test_eu_sanctions_import_entities(self):
+        filename = os.path.join(settings.BASE_DIR, "data/eu/test-sanctions.xml")
+        source = SanctionsListFile.objects.create_from_filename(filename, list_type="EU")
+        import_eu_sanctions(source, verbose=False)
+        self.assertEqual(source.generation_date, date(2021, 3, 5))
+        self.assertEqual(source.global_file_id, "119437")
+        self.assertEqual(list(SanctionEntity.objects.filter(source=source).order_by("logical_id").values_list("logical_id", flat=True)), [13, 14])
+
+        person = SanctionEntity.objects.get(source=source, logical_id=13)
+        self.assertEqual(person.eu_reference_number, "EU.27.28")
+        self.assertEqual(person.united_nation_id, "QDi.001")
+        self.assertEqual(person.subject_type.classification_code, "P")
+        self.assertEqual(
+            list(person.namealias_set.order_by("logical_id").values_list("first_name", "last_name", "whole_name", "function")),
+            [("John", "Doe", "John Doe", "Leader"), ("", "", "Johnny Doe", "")],
+        )
+        self.assertEqual(list(Remark.objects.filter(container=person).values_list("text", flat=True)), ["Head of a terrorist organisation."])
+        address = Address.objects.get(sanction=person)
+        self.assertEqual((address.street, address.city, address.country_iso2_code), ("Palestine Street 1", "Baghdad", "SY"))
+        self.assertEqual(list(Remark.objects.filter(container=address).values_list("text", flat=True)), ["Previous address."])
+        birth_date = BirthDate.objects.get(sanction=person)
+        self.assertEqual((birth_date.birth_date, birth_date.year, birth_date.city), (date(1957, 3, 10), 1957, "Tikrit"))
+        self.assertEqual(list(Remark.objects.filter(container=birth_date).values_list("text", flat=True)), ["Date of birth unconfirmed."])
+        self.assertEqual(list(person.citizenship_set.values_list("country_iso2_code", flat=True)), ["IQ"])
+        self.assertEqual(list(person.identification_set.values_list("identification_type_code", "number")), [("passport", "M0003264580")])
+        self.assertEqual(list(person.regulation_set.values_list("number_title", flat=True)), ["2002/881 (OJ L139)"])
+
+        enterprise = SanctionEntity.objects.get(source=source, logical_id=14)
+        self.assertEqual(enterprise.subject_type.classification_code, "E")
+        self.assertEqual(list(enterprise.namealias_set.values_list("whole_name", flat=True)), ["Example Trading Company"])
+        self.assertEqual(list(enterprise.address_set.values_list("street", "country_iso2_code")), [("Saadoun Street 5", "IQ")])
+        self.assertFalse(enterprise.birthdate_set.exists())
+
+    def test_ofac_sanctions_import_entities(self):
+        filename = os.path.join(settings.BASE_DIR, "data/ofac/test-sdn.xml")
+        source = SanctionsListFile.objects.create_from_filename(filename, list_type="OFAC")
+        import_ofac_sanctions(source, verbose=False)
+        self.assertEqual(source.generation_date, date(2021, 3, 12))
+        self.assertEqual(list(SanctionEntity.objects.filter(source=source).order_by("logical_id").values_list("logical_id", flat=True)), [306, 307])
+
+        person = SanctionEntity.objects.get(source=source, logical_id=306)
+        self.assertEqual(person.subject_type.classification_code, "P")
+        self.assertEqual(
+            list(person.namealias_set.order_by("id").values_list("first_name", "last_name", "whole_name")),
+            [("Juan", "PEREZ", "Juan PEREZ"), ("Juanito", "PEREZ", "Juanito PEREZ")],
+        )
+        self.assertEqual(
+            list(Remark.objects.filter(container=person).order_by("id").values_list("text", flat=True)),
+            ["Linked To: EXAMPLE TRADING S.A.", "program=CUBA", "program=SDGT"],
+        )
+        self.assertEqual(list(person.address_set.values_list("street", "city", "country_iso2_code")), [("Calle 1\nPiso 2", "Havana", "CU")])
+        self.assertEqual(list(person.identification_set.values_list("number", "country_iso2_code")), [("X123456", "CU")])
+        # places of birth are merged into date of birth rows in order, extra places get rows of their own
+        self.assertEqual(
+            list(person.birthdate_set.order_by("id").values_list("birth_date_description", "birth_date", "year", "place")),
+            [
+                ("12 Jan 1960", date(1960, 1, 12), 1960, "Havana, Cuba"),
+                ("1961", None, 1961, "Mariel, Cuba"),
+                ("", None, None, "Santiago, Cuba"),
+            ],
+        )
+
+        entity = SanctionEntity.objects.get(source=source, logical_id=307)
+        self.assertEqual(entity.subject_type.classification_code, "E")
+        self.assertEqual(list(entity.namealias_set.values_list("whole_name", flat=True)), ["EXAMPLE TRADING S.A."])
+        self.assertEqual(list(entity.address_set.values_list("street", "city", "country_iso2_code")), [("Avenida 5", "Panama City", "PA")])
+        self.assertEqual(list(Remark.objects.filter(container=entity).values_list("text", flat=True)), ["program=CUBA"])
+        self.assertFalse(entity.birthdate_set.exists())
+
+    def test_ofac_sanctions_incremental_import(self):
+        filename = os.path.join(settings.BASE_DIR, "data/ofac/test-sdn.xml")
+        sdn_url, consolidated_url = "https://example.com/sdn.xml", "https://example.com/consolidated.xml"
+        source1 = SanctionsListFile.objects.create_from_filename(filename, list_type="OFAC", url=sdn_url)
+        import_ofac_sanctions(source1, incremental=True)
+        # files from other URLs of the list type are not matched
+        source2 = SanctionsListFile.objects.create_from_filename(filename, list_type="OFAC", url=consolidated_url)
+        imp = import_ofac_sanctions(source2, incremental=True)
+        assert imp.matcher is not None
+        self.assertEqual((imp.matcher.unchanged_count, imp.matcher.removed_count), (0, 0))
+        self.assertEqual(SanctionEntity.objects.filter(source=source1).count(), 2)
+        source3 = SanctionsListFile.objects.create_from_filename(filename, list_type="OFAC", url=sdn_url)
+        imp = import_ofac_sanctions(source3, incremental=True)
+        assert imp.matcher is not None
+        self.assertEqual((imp.matcher.unchanged_count, imp.matcher.removed_count), (2, 0))
+        self.assertFalse(SanctionEntity.objects.filter(source=source1).exists())
+        self.assertEqual(SanctionEntity.objects.filter(source=source2).count(), 2)
+
     def test_un_sanctions_import(self):
         filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
         source = SanctionsListFile.objects.create_from_filename(filename)
@@ -31,3 +232,317 @@ class Tests(TestCase):
         import_un_sanctions(source, verbose=False)
         print("UN count =", SanctionEntity.objects.all().filter(source=source).count())
         self.assertEqual(SanctionEntity.objects.all().filter(source=source).count(), 711 + 293)
+
+    def test_iterparse_xml_elements(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        with open(filename, "rb") as fp:
+            data = xml_to_dict(fp.read(), array_tags=UN_XML_ARRAY_TAGS)
+        elements = list(iterparse_xml_elements(filename, ["INDIVIDUAL", "ENTITY"], array_tags=UN_XML_ARRAY_TAGS))
+        self.assertEqual(elements[0], ("CONSOLIDATED_LIST", {k: v for k, v in data.items() if k.startswith("@")}))
+        self.assertEqual([e for tag, e in elements if tag == "INDIVIDUAL"], data["INDIVIDUALS"]["INDIVIDUAL"])
+        self.assertEqual([e for tag, e in elements if tag == "ENTITY"], data["ENTITIES"]["ENTITY"])
+
+    def test_compressed_sanction_list_files(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        content_hash = get_file_hash(filename)
+        elements = list(iterparse_xml_elements(filename, ["INDIVIDUAL", "ENTITY"], array_tags=UN_XML_ARRAY_TAGS))
+        for compression, ext in COMPRESSION_EXTENSIONS.items():
+            with self.subTest(compression=compression):
+                if compression == ZSTD_COMPRESSION and importlib.util.find_spec("zstandard") is None:
+                    self.skipTest("zstandard not installed")
+                source = SanctionsListFile.objects.create_from_filename(filename, compression=compression, list_type=UN_LIST_TYPE)
+                try:
+                    self.assertTrue(source.file.name.endswith(".xml" + ext))
+                    with open(source.full_path, "rb") as fp:
+                        self.assertNotEqual(fp.read(5), b"<?xml")
+                    self.assertEqual(source.content_hash, content_hash)
+                    self.assertEqual(get_file_hash(source.full_path), content_hash)
+                    self.assertEqual(list(iterparse_xml_elements(source.full_path, ["INDIVIDUAL", "ENTITY"], array_tags=UN_XML_ARRAY_TAGS)), elements)
+                finally:
+                    os.unlink(source.full_path)
+
+    def test_un_sanctions_incremental_import(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        source1 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source1, incremental=True)
+        source2 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source2, incremental=True)
+        self.assertEqual(SanctionEntity.objects.all().filter(source=source1).count(), 0)
+        self.assertEqual(SanctionEntity.objects.all().filter(source=source2).count(), 711 + 293)
+
+    def test_active_sanction_list_files(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        source1 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source1, activate=True)
+        source2 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source2)
+        self.assertEqual(SanctionEntity.objects.active().count(), 711 + 293)
+        self.assertFalse(SanctionEntity.objects.active().filter(source=source2).exists())
+        activate_sanction_list_files(UN_LIST_TYPE, [source2])
+        self.assertEqual(SanctionEntity.objects.active().count(), 711 + 293)
+        self.assertFalse(SanctionEntity.objects.active().filter(source=source1).exists())
+
+        # incremental import keeps unchanged entities active until the import is completed
+        source3 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        imp = import_un_sanctions(source3, incremental=True, complete=False)
+        self.assertEqual(SanctionEntity.objects.active().filter(source=source2).count(), 711 + 293)
+        complete_sanction_list_imports([imp], [source3])
+        self.assertEqual(SanctionEntity.objects.active().filter(source=source3).count(), 711 + 293)
+
+    def test_delete_inactive_sanction_lists(self):
+        failed = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE)
+        old = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE, imported=now())
+        active = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE, imported=now())
+        activate_sanction_list_files(UN_LIST_TYPE, [active])
+        pending = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE)
+        call_command("delete_inactive_sanction_lists")
+        self.assertEqual(list(SanctionsListFile.objects.filter(id__in=[failed.id, old.id, active.id, pending.id]).order_by("id")), [active, pending])
+
+    def test_sanction_entity_data_storage(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        source1 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source1)
+        object_count = SanctionListObject.objects.all().count()
+        with override_settings(JSANCTIONS_DATA_STORAGE="compressed"):
+            source2 = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+            import_un_sanctions(source2)
+        self.assertEqual(SanctionEntityData.objects.all().count(), 711 + 293)
+        se1 = SanctionEntity.objects.all().filter(source=source1).order_by("id").first()
+        se2 = SanctionEntity.objects.all().filter(source=source2, logical_id=se1.logical_id).first()
+        self.assertEqual(se2.data, {})
+        self.assertEqual(se2.get_data(), se1.get_data())
+        delete_old_sanction_list_files(UN_LIST_TYPE, [source1], chunk_size=100)
+        self.assertEqual(SanctionEntityData.objects.all().count(), 0)
+        self.assertEqual(SanctionEntity.objects.all().count(), 711 + 293)
+        self.assertEqual(SanctionListObject.objects.all().count(), object_count)
+
+    @skipUnless(connection.vendor == "postgresql", "COPY loader requires PostgreSQL")
+    @override_settings(JSANCTIONS_DATA_STORAGE=DATA_STORAGE_COMPRESSED)
+    def test_copy_loader(self):
+        for filename, list_type, import_sanctions in [
+            ("data/eu/test-sanctions.xml", "EU", import_eu_sanctions),
+            ("data/ofac/test-sdn.xml", "OFAC", import_ofac_sanctions),
+            ("data/un/consolidated.xml", UN_LIST_TYPE, import_un_sanctions),
+        ]:
+            filename = os.path.join(settings.BASE_DIR, filename)
+            source1 = SanctionsListFile.objects.create_from_filename(filename, list_type=list_type)
+            import_sanctions(source1, loader=BULK_LOADER, batch_size=50)
+            source2 = SanctionsListFile.objects.create_from_filename(filename, list_type=list_type)
+            import_sanctions(source2, loader=COPY_LOADER, batch_size=50)
+            rows1, rows2 = get_imported_rows(source1), get_imported_rows(source2)
+            self.assertTrue(rows1["SanctionEntity"])
+            self.assertEqual(rows1, rows2)
+            self.assertEqual(
+                SanctionEntityData.objects.filter(entity__source=source1).count(), SanctionEntityData.objects.filter(entity__source=source2).count()
+            )
+
+    def test_search_name(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        source = SanctionsListFile.objects.create_from_filename(filename, list_type=UN_LIST_TYPE)
+        import_un_sanctions(source)
+        alias = NameAlias.objects.all().exclude(whole_name="").order_by("id").first()
+        res = list(SanctionEntity.objects.search_name(" " + alias.whole_name.upper() + " "))
+        self.assertIn(alias.sanction_id, [e.id for e in res])
+        self.assertFalse(SanctionEntity.objects.search_name("xyzzy-no-such-name").exists())
+        if is_name_search_supported():
+            self.assertAlmostEqual(next(e.name_similarity for e in res if e.id == alias.sanction_id), 1.0)
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW pg_trgm.similarity_threshold")
+                threshold = cursor.fetchone()[0]
+                list(SanctionEntity.objects.search_name(alias.whole_name, min_similarity=0.9))
+                cursor.execute("SHOW pg_trgm.similarity_threshold")
+                self.assertEqual(cursor.fetchone()[0], threshold)
+
+        # admin search keeps substring matches of single words of long names
+        alias = NameAlias.objects.all().filter(whole_name__contains=" ").order_by("-whole_name").first()
+        word = max(alias.whole_name.split(), key=len)
+        model_admin = SanctionEntityAdmin(SanctionEntity, admin.site)
+        qs, may_have_duplicates = model_admin.get_search_results(RequestFactory().get("/"), SanctionEntity.objects.all(), word)
+        self.assertIn(alias.sanction_id, list(qs.values_list("id", flat=True)))
+
+    def test_discard_already_imported_sanction_list_file(self):
+        filename = os.path.join(settings.BASE_DIR, "data/un/consolidated.xml")
+        input_files = [get_media_full_path("uploads/test-un-{}.xml".format(i)) for i in range(2)]
+        os.makedirs(os.path.dirname(input_files[0]), exist_ok=True)
+        try:
+            for input_file in input_files:
+                shutil.copyfile(filename, input_file)
+            source1 = SanctionsListFile.objects.create_from_filename(input_files[0], list_type=UN_LIST_TYPE)
+            import_un_sanctions(source1)
+            source2 = SanctionsListFile.objects.create_from_filename(input_files[1], list_type=UN_LIST_TYPE)
+            self.assertEqual(discard_already_imported_sanction_list_file(source2, keep_file=True), source1)
+            self.assertTrue(os.path.isfile(input_files[1]))
+            self.assertFalse(SanctionsListFile.objects.filter(id=source2.id).exists())
+        finally:
+            for input_file in input_files:
+                os.unlink(input_file)
+
+        # generation date matches only files from the same URL
+        d = date(2021, 3, 5)
+        prev = SanctionsListFile.objects.create(list_type="OFAC", url="https://example.com/consolidated.xml", generation_date=d, imported=now())
+        self.assertIsNone(find_imported_sanction_list_file("OFAC", generation_date=d, url="https://example.com/sdn.xml"))
+        self.assertEqual(find_imported_sanction_list_file("OFAC", generation_date=d, url="https://example.com/consolidated.xml"), prev)
+
+        # only the newest imported file is compared, content A -> B -> A is imported again
+        a1 = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE, content_hash="a", imported=now())
+        self.assertEqual(find_imported_sanction_list_file(UN_LIST_TYPE, "a"), a1)
+        SanctionsListFile.objects.create(list_type=UN_LIST_TYPE, content_hash="b", imported=now())
+        self.assertIsNone(find_imported_sanction_list_file(UN_LIST_TYPE, "a"))
+
+        # validators of the discarded download are kept for the next conditional request
+        new = SanctionsListFile.objects.create(list_type="OFAC", url="https://example.com/consolidated.xml", etag='"v2"', last_modified="Fri, 05 Mar 2021")
+        self.assertEqual(discard_already_imported_sanction_list_file(new, d), prev)
+        self.assertEqual(SanctionsListFile.objects.get_conditional_headers(prev.url), {"If-None-Match": '"v2"', "If-Modified-Since": "Fri, 05 Mar 2021"})
+
+    def test_download_not_modified(self):
+        url = "https://example.com/consolidated.xml"
+        SanctionsListFile.objects.create(list_type=UN_LIST_TYPE, url=url, etag='"v1"', last_modified="Fri, 05 Mar 2021", imported=now())
+        downloader = DownloadManager()
+        session = mock.Mock()
+        with mock.patch.object(downloader, "get_session", return_value=session):
+            session.get.return_value = FakeResponse(304)
+            self.assertEqual(SanctionsListFile.objects.create_from_urls([(url, "consolidated.xml")], list_type=UN_LIST_TYPE, downloader=downloader), [None])
+            headers = session.get.call_args.kwargs["headers"]
+            self.assertEqual(headers["If-None-Match"], '"v1"')
+            self.assertEqual(headers["If-Modified-Since"], "Fri, 05 Mar 2021")
+            self.assertEqual(headers["Accept-Encoding"], "gzip")
+
+            session.get.return_value = FakeResponse(200, [b"<xml>", b"</xml>"], {"ETag": '"v2"'})
+            file = SanctionsListFile.objects.create_from_url(url, "consolidated.xml", list_type=UN_LIST_TYPE, downloader=downloader)
+            assert isinstance(file, SanctionsListFile)
+            self.assertEqual(file.etag, '"v2"')
+            self.assertEqual(file.content_hash, get_file_hash(file.full_path))
+            with open(file.full_path, "rb") as fp:
+                self.assertEqual(fp.read(), b"<xml></xml>")
+
+    def test_download_retry(self):
+        with DownloadManager(retries=5, backoff_factor=0.5) as downloader:
+            for legacy_ssl in [False, True]:
+                session = downloader.get_session(legacy_ssl)
+                self.assertIs(downloader.get_session(legacy_ssl), session)
+                for url in ["http://example.com/sdn.xml", "https://example.com/sdn.xml"]:
+                    retry = session.get_adapter(url).max_retries
+                    self.assertEqual(retry.total, 5)
+                    self.assertEqual(retry.backoff_factor, 0.5)
+                    self.assertEqual(set(retry.status_forcelist), {429, 500, 502, 503, 504})
+                    self.assertEqual(list(retry.allowed_methods), ["GET"])
+
+    def test_download_per_host_concurrency(self):
+        lock = threading.Lock()
+        active: Dict[str, int] = defaultdict(int)
+        peak: Dict[str, int] = defaultdict(int)
+
+        def get(url, **kwargs):
+            host = urlsplit(url).netloc
+            with lock:
+                active[host] += 1
+                peak[host] = max(peak[host], active[host])
+            time.sleep(0.05)
+            with lock:
+                active[host] -= 1
+            return FakeResponse(200, [url.encode()])
+
+        downloader = DownloadManager(max_workers=8, max_per_host=2)
+        urls = ["https://{}.example.com/{}.xml".format(host, i) for host in ["a", "b"] for i in range(4)]
+        with mock.patch.object(downloader, "get_session", return_value=mock.Mock(get=get)):
+            files = downloader.fetch_all([DownloadRequest(url) for url in urls])
+        self.assertEqual(set(peak), {"a.example.com", "b.example.com"})
+        self.assertLessEqual(max(peak.values()), 2)
+        for url, file in zip(urls, files):
+            self.assertEqual(file.file.read(), url.encode())
+            file.close()
+
+    def test_download_error_cleanup(self):
+        tmp_files = []
+
+        def temporary_file(*args, **kwargs):
+            tmp_files.append(real_temporary_file(*args, **kwargs))
+            return tmp_files[-1]
+
+        def get(url, **kwargs):
+            if url.endswith("/broken.xml"):
+                return FakeResponse(200, [b"<partial"], error=requests.ConnectionError("Connection reset"))
+            if url.endswith("/missing.xml"):
+                return FakeResponse(404)
+            return FakeResponse(200, [b"<xml/>"])
+
+        real_temporary_file = tempfile.TemporaryFile
+        downloader = DownloadManager()
+        with mock.patch.object(downloader, "get_session", return_value=mock.Mock(get=get)):
+            with mock.patch("jsanctions.download.tempfile.TemporaryFile", side_effect=temporary_file):
+                with self.assertRaises(requests.ConnectionError):
+                    downloader.fetch_all([DownloadRequest("https://a.example.com/ok.xml"), DownloadRequest("https://b.example.com/broken.xml")])
+                with self.assertRaises(requests.HTTPError):
+                    downloader.fetch(DownloadRequest("https://a.example.com/missing.xml"))
+        self.assertEqual(len(tmp_files), 2)
+        self.assertTrue(all(fp.closed for fp in tmp_files))
+
+    def test_import_all_sanctions(self):
+        ofac_file = SanctionsListFile.objects.create(list_type="OFAC")
+        un_file = SanctionsListFile.objects.create(list_type=UN_LIST_TYPE)
+        retained = {"import_ofac_sanctions": [ofac_file.id], "import_un_sanctions": [un_file.id]}
+        events: List[Tuple[Any, ...]] = []
+        failing: List[str] = []
+
+        def run_import_command(command_name, args):
+            import_module("jsanctions.management.commands." + command_name).Command().create_parser("manage.py", command_name).parse_args(args)
+            events.append(("import", command_name, args))
+            if command_name in failing:
+                raise Exception("Import failed")
+            return 0.0, retained[command_name]
+
+        def delete_old_sanction_list_files(list_type, exclude, chunk_size):  # pylint: disable=redefined-outer-name
+            events.append(("delete", list_type, exclude, chunk_size))
+
+        args = ["--lists", "OFAC", "UN", "--loader", "copy", "--incremental", "--batch-size", "100", "--workers", "2", "--compress", "gzip"]
+        args += ["--delete-old", "--delete-chunk-size", "50"]
+        forwarded = ["--loader", "copy", "--incremental", "--batch-size", "100", "--workers", "2", "--compress", "gzip"]
+        module = "jsanctions.management.commands.import_all_sanctions"
+        with mock.patch(module + ".ProcessPoolExecutor", SyncExecutor), mock.patch(module + ".connections"):
+            with mock.patch(module + ".run_import_command", run_import_command), mock.patch(
+                module + ".delete_old_sanction_list_files", delete_old_sanction_list_files
+            ):
+                call_command("import_all_sanctions", *args)
+                self.assertEqual(
+                    events,
+                    [
+                        ("import", "import_ofac_sanctions", ["--url-defaults"] + forwarded),
+                        ("import", "import_un_sanctions", ["--url-defaults"] + forwarded),
+                        ("delete", "OFAC", [ofac_file], 50),
+                        ("delete", UN_LIST_TYPE, [un_file], 50),
+                    ],
+                )
+
+                # nothing is deleted unless all imports succeed
+                events.clear()
+                failing.append("import_un_sanctions")
+                with self.assertRaises(Exception):
+                    call_command("import_all_sanctions", *args)
+                self.assertEqual([e[0] for e in events], ["import", "import"])
+
+    def test_run_import_batch_bisect(self):
+        imported = []
+
+        def import_batch(source, items):
+            if 13 in items:
+                raise Exception("Invalid record")
+            imported.extend(items)
+
+        with self.assertRaises(Exception):
+            run_import_batch(import_batch, False, None, list(range(20)))
+        self.assertEqual(run_import_batch(import_batch, True, None, list(range(20))), 1)
+        self.assertEqual(sorted(imported), [i for i in range(20) if i != 13])
+
+    def test_get_country_iso2_code(self):
+        for name, code in [
+            ("Finland", "FI"),
+            ("russian federation", "RU"),
+            ("Iran (Islamic Republic of)", "IR"),
+            ("Syrian Arab Republic", "SY"),
+            ("Côte d'Ivoire", "CI"),
+            ("Curacao", "CW"),
+            ("The Bahamas", "BS"),
+            ("Gambia, The", "GM"),
+            ("Atlantis", ""),
+        ]:
+            self.assertEqual(get_country_iso2_code(name), code)
@@ -1,7 +1,7 @@
 import logging
-from typing import Any, Dict, List, Optional
+from datetime import date
+from typing import Any, Dict, List, Optional, Iterator, Tuple
 from django.core.exceptions import ValidationError
-from django.db import transaction
 from django.utils.dateparse import parse_date
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
@@ -9,7 +9,9 @@ from jutil.admin import admin_log
 from jutil.format import choices_label
 from jutil.parse import parse_datetime
 from jutil.xml import xml_to_dict
-from jsanctions.helpers import get_country_iso2_code
+from jsanctions.bulk import BulkWriter, LookupCache, DEFAULT_IMPORT_BATCH_SIZE, BULK_LOADER, create_bulk_writer, save_object, save_sanction_entity_data
+from jsanctions.helpers import open_compressed_file, get_data_hash, get_country_iso2_code, iterparse_xml_elements
+from jsanctions.services import SanctionListImport, import_sanction_list_file
 from jsanctions.models import (
     SanctionsListFile,
     SanctionEntity,
@@ -42,11 +44,26 @@ UN_NAME_FIELDS = ["FIRST_NAME", "SECOND_NAME", "THIRD_NAME", "FOURTH_NAME", "FIF
 
 
 def load_un_sanction_list_as_dict(filename: str) -> Dict[str, Any]:
-    with open(filename, "rb") as fp:
+    with open_compressed_file(filename) as fp:
         data: Dict[str, Any] = xml_to_dict(fp.read(), array_tags=UN_XML_ARRAY_TAGS)
     return data
 
 
+def iter_un_sanction_list(filename: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Parses UN sanction list incrementally. Yields root element attributes first
+    (including @dateGenerated) and then each INDIVIDUAL and ENTITY as (tag, data) pairs.
+    """
+    yield from iterparse_xml_elements(filename, ["INDIVIDUAL", "ENTITY"], array_tags=UN_XML_ARRAY_TAGS)
+
+
+def read_un_generation_date(filename: str) -> Optional[date]:
+    """Returns UN sanction list generation date by parsing only the beginning of the file."""
+    for tag, data in iter_un_sanction_list(filename):
+        generation_date_str = data.get("@dateGenerated") or data.get("@generationDate")
+        return parse_datetime(generation_date_str).date() if generation_date_str else None
+    return None
+
+
 def parse_un_data_id(data: Dict[str, Any]) -> int:
     uid = data.get("DATAID")
     if uid is None:
@@ -54,7 +71,7 @@ def parse_un_data_id(data: Dict[str, Any]) -> int:
     return int(uid)
 
 
-def create_un_alias(se: SanctionEntity, **kwargs) -> Optional[NameAlias]:
+def build_un_alias(se: SanctionEntity, **kwargs) -> Optional[NameAlias]:
     names = []
     for k in UN_NAME_FIELDS:
         if k in kwargs and kwargs[k]:
@@ -67,33 +84,40 @@ def create_un_alias(se: SanctionEntity, **kwargs) -> Optional[NameAlias]:
     alias.title = kwargs.get("TITLE") or ""
     alias.last_name = names.pop() or ""
     alias.first_name = " ".join(names).strip()
-    alias.full_clean()
-    alias.save()
     return alias
 
 
-def create_un_comments(se: SanctionEntity, **kwargs) -> List[Remark]:
+def create_un_alias(se: SanctionEntity, **kwargs) -> Optional[NameAlias]:
+    alias = build_un_alias(se, **kwargs)
+    if alias is not None:
+        save_object(alias)
+    return alias
+
+
+def build_un_comments(se: SanctionEntity, **kwargs) -> List[Remark]:
     out: List[Remark] = []
     for n in range(1, 10):
         k = "COMMENTS{}".format(n)
         if k in kwargs and kwargs[k]:
-            obj_out = Remark(container=se, text=kwargs.get(k) or "")  # type: ignore
-            obj_out.full_clean()
-            obj_out.save()
-            out.append(obj_out)
+            out.append(Remark(container=se, text=kwargs.get(k) or ""))  # type: ignore
         else:
             break
     return out
 
 
-def create_un_note(obj: SanctionListObject, note: Any):
+def create_un_comments(se: SanctionEntity, **kwargs) -> List[Remark]:
+    out = build_un_comments(se, **kwargs)
+    for obj_out in out:
+        save_object(obj_out)
+    return out
+
+
+def create_un_note(obj: SanctionListObject, note: Any, writer: Optional[BulkWriter] = None):
     if note:
-        remark = Remark(container=obj, text=str(note))
-        remark.full_clean()
-        remark.save()
+        save_object(Remark(container=obj, text=str(note)), writer)
 
 
-def create_un_address(se: SanctionEntity, **kwargs) -> Address:
+def build_un_address(se: SanctionEntity, **kwargs) -> Address:
     # {'STATE_PROVINCE', 'NOTE', 'COUNTRY', 'STREET', 'CITY', 'ZIP_CODE'}
     address = Address(sanction=se)
     address.region = kwargs.get("STATE_PROVINCE") or ""
@@ -104,13 +128,17 @@ def create_un_address(se: SanctionEntity, **kwargs) -> Address:
     for k, v in kwargs.items():
         if hasattr(address, k):
             setattr(address, k, v)
-    address.full_clean()
-    address.save()
-    create_un_note(address, kwargs.get("NOTE"))
     return address
 
 
-def create_un_document(se: SanctionEntity, **kwargs) -> Identification:
+def create_un_address(se: SanctionEntity, writer: Optional[BulkWriter] = None, **kwargs) -> Address:
+    address = build_un_address(se, **kwargs)
+    save_object(address, writer)
+    create_un_note(address, kwargs.get("NOTE"), writer)
+    return address
+
+
+def build_un_document(se: SanctionEntity, **kwargs) -> Identification:
     # {'DATE_OF_ISSUE', 'NUMBER', 'NOTE', 'ISSUING_COUNTRY', 'CITY_OF_ISSUE', 'COUNTRY_OF_ISSUE',
     # 'TYPE_OF_DOCUMENT', 'TYPE_OF_DOCUMENT2'}
     id_obj = Identification(sanction=se)
@@ -119,9 +147,13 @@ def create_un_document(se: SanctionEntity, **kwargs) -> Identification:
     id_obj.latin_number = kwargs.get("NUMBER") or ""
     id_obj.issued_by = "{} {} {}".format(kwargs.get("CITY_OF_ISSUE") or "", kwargs.get("COUNTRY_OF_ISSUE") or "", kwargs.get("ISSUING_COUNTRY") or "").strip()
     id_obj.country_description = kwargs.get("COUNTRY_OF_ISSUE") or kwargs.get("ISSUING_COUNTRY") or ""
-    id_obj.full_clean()
-    id_obj.save()
-    create_un_note(id_obj, kwargs.get("NOTE"))
+    return id_obj
+
+
+def create_un_document(se: SanctionEntity, writer: Optional[BulkWriter] = None, **kwargs) -> Identification:
+    id_obj = build_un_document(se, **kwargs)
+    save_object(id_obj, writer)
+    create_un_note(id_obj, kwargs.get("NOTE"), writer)
     return id_obj
 
 
@@ -130,15 +162,26 @@ def set_un_members(  # noqa
     data: Dict[str, Any],
     verbose: bool = False,
     padding: int = 0,
+    writer: Optional[BulkWriter] = None,
 ):
+    """Sets sanction entity attributes and creates child objects from parsed UN INDIVIDUAL/ENTITY data.
+    If writer is specified objects are added to the writer and validated in batches instead of
+    calling full_clean() and save() for each object.
+    """
+    if writer is not None:
+        writer.add(se)
+
     # DATAID
     se.logical_id = parse_un_data_id(data)
 
     # FIRST_NAME, ...
-    create_un_alias(se, **data)
+    alias = build_un_alias(se, **data)
+    if alias is not None:
+        save_object(alias, writer)
 
     # COMMENTSx
-    create_un_comments(se, **data)
+    for remark in build_un_comments(se, **data):
+        save_object(remark, writer)
 
     # INVIDUAL_ADDRESS / ENTITY_ADDRESS
     address_list = data.get("INVIDUAL_ADDRESS", []) or data.get("ENTITY_ADDRESS", [])
@@ -146,7 +189,7 @@ def set_un_members(  # noqa
     if address_list:
         for e_data in address_list:
             if e_data:
-                addresses.append(create_un_address(se, **e_data))
+                addresses.append(create_un_address(se, writer, **e_data))
 
     # try to fill address information from UN list name
     if not addresses:
@@ -154,62 +197,94 @@ def set_un_members(  # noqa
         if un_list_type:
             country_code = get_country_iso2_code(un_list_type)
             if country_code:
-                create_un_address(se, country_description=un_list_type, country_code=country_code)
+                create_un_address(se, writer, country_description=un_list_type, country_code=country_code)
 
     # INDIVIDUAL_DOCUMENT
     docs = data.get("INDIVIDUAL_DOCUMENT")
     if docs:
         for e_data in docs:
             if e_data:
-                create_un_document(se, **e_data)
+                create_un_document(se, writer, **e_data)
 
-    se.full_clean()
-    se.save()
+    if writer is None:
+        se.full_clean()
+        se.save()
     if verbose:
-        logger.debug("%sSaved %s", padding * " ", se)
+        logger.debug("%s%s %s", padding * " ", "Saved" if writer is None else "Prepared", se)
+
 
+def import_un_sanction_entities(
+    source: SanctionsListFile, items: List[Tuple[Dict[str, Any], str, SubjectType]], verbose: bool = False, loader: str = BULK_LOADER
+):
+    """Imports a batch of parsed INDIVIDUAL/ENTITY (data, data hash, subject type) tuples in a single transaction."""
+    writer = create_bulk_writer(loader, validate=True)
+    for se_data, data_hash, subject_type in items:
+        se = SanctionEntity(source=source, data_hash=data_hash, subject_type=subject_type)
+        set_un_members(se, se_data, verbose=verbose, padding=4, writer=writer)
+        save_sanction_entity_data(se, se_data, writer)
+    writer.flush()
+
+
+def iter_un_sanction_records(
+    source: SanctionsListFile, subject_types: Dict[str, SubjectType], counts: Dict[str, int], verbose: bool = False
+) -> Iterator[Tuple[Optional[int], str, Tuple[Dict[str, Any], str, SubjectType]]]:
+    """Yields (logical id, data hash, (data, data hash, subject type)) of INDIVIDUAL and ENTITY elements, see import_sanction_list_file().
+    Generation date is set to the source and number of elements per tag counted to counts."""
+    for tag, se_data in iter_un_sanction_list(source.full_path):
+        if tag not in subject_types:
+            generation_date_str = se_data.get("@dateGenerated") or se_data.get("@generationDate")
+            if not generation_date_str:
+                raise Exception("Generation date missing")
+            source.generation_date = parse_datetime(generation_date_str).date()
+            continue
+        assert isinstance(se_data, dict)
+        if verbose:
+            logger.debug("  sdnEntry uid %s", se_data.get("uid"))
+        data_hash = get_data_hash(se_data)
+        counts[tag] += 1
+        yield parse_un_data_id(se_data), data_hash, (se_data, data_hash, subject_types[tag])
 
-def import_un_sanctions(source: SanctionsListFile, verbose: bool = False):
-    data = load_un_sanction_list_as_dict(source.full_path)
-    generation_date_str = data.get("@dateGenerated") or data.get("@generationDate")
-    if not generation_date_str:
-        raise Exception("Generation date missing")
-    source.generation_date = parse_datetime(generation_date_str).date()
 
-    enterprise, created = SubjectType.objects.get_or_create(classification_code=SubjectType.ENTERPRISE)
+def import_un_sanctions(
+    source: SanctionsListFile,
+    verbose: bool = False,
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+    loader: str = BULK_LOADER,
+    incremental: bool = False,
+    workers: int = 0,
+    bisect: bool = False,
+    activate: bool = False,
+    complete: bool = True,
+) -> SanctionListImport:
+    """Imports UN sanction list file, see import_sanction_list_file() for the options."""
+    lookups = LookupCache()
+    enterprise, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.ENTERPRISE)
     assert isinstance(enterprise, SubjectType)
     if created or not enterprise.code:
         enterprise.code = choices_label(SubjectType.CLASSIFICATION_CODES, enterprise.classification_code)
         enterprise.save()
-    person, created = SubjectType.objects.get_or_create(classification_code=SubjectType.PERSON)
+    person, created = lookups.get_or_create(SubjectType, classification_code=SubjectType.PERSON)
     assert isinstance(person, SubjectType)
     if created or not person.code:
         person.code = choices_label(SubjectType.CLASSIFICATION_CODES, person.classification_code)
         person.save()
+    subject_types = {"INDIVIDUAL": person, "ENTITY": enterprise}
 
     t0 = now()
-    individuals_list = data.get("INDIVIDUALS", {}).get("INDIVIDUAL")
-    for se_data in individuals_list:
-        assert isinstance(se_data, dict)
-        if verbose:
-            logger.debug("  sdnEntry uid %s", se_data.get("uid"))
-        with transaction.atomic():
-            se = SanctionEntity.objects.create(source=source, data=se_data, subject_type=person)
-            set_un_members(se, se_data, verbose=verbose, padding=4)
-
-    entities_list = data.get("ENTITIES", {}).get("ENTITY")
-    for se_data in entities_list:
-        assert isinstance(se_data, dict)
-        if verbose:
-            logger.debug("  sdnEntry uid %s", se_data.get("uid"))
-        with transaction.atomic():
-            se = SanctionEntity.objects.create(source=source, data=se_data, subject_type=enterprise)
-            set_un_members(se, se_data, verbose=verbose, padding=4)
-
-    source.imported = now()
-    source.save()
-    msg = "Imported {} sanction entities and {} individuals from {} in {}".format(
-        len(entities_list), len(individuals_list), source.full_path, source.imported - t0
+    counts = {"INDIVIDUAL": 0, "ENTITY": 0}
+    imp = import_sanction_list_file(
+        source,
+        iter_un_sanction_records(source, subject_types, counts, verbose),
+        import_un_sanction_entities,
+        (verbose, loader),
+        batch_size=batch_size,
+        incremental=incremental,
+        workers=workers,
+        bisect=bisect,
+        activate=activate,
+        complete=complete,
     )
+    msg = "Imported {} sanction entities and {} individuals from {} in {}".format(counts["ENTITY"], counts["INDIVIDUAL"], source.full_path, now() - t0)
     logger.info(msg)
     admin_log([source], msg)
+    return imp